@@ -1,8 +1,11 @@
 import dash
 import logging
+from flask_compress import Compress
 
 external_stylesheets = ['https://codepen.io/chriddyp/pen/bWLwgP.css']
 logging.basicConfig(level=logging.INFO)
 
 app = dash.Dash(__name__, external_stylesheets=external_stylesheets)
 app.config.suppress_callback_exceptions = True
+# gzip the callback responses and the javascript bundles
+Compress(app.server)
@@ -1,97 +1,130 @@
-import pandas as pd
+import math
 
 import plotly.express as px
+import dash
 from dash.dependencies import Input, Output
+from dash.exceptions import PreventUpdate
 import dash_html_components as html
 
-from modules.dataloader import read_image
+from modules.downsample import downsample, visible_range
+from modules.media import get_media_url, prefetch_media
+from modules.network import get_graph_payload
+from modules.topwords import CAPACITY, get_top_words
+from modules.perf import timed
+from modules.store import get_artifact, request_artifacts, loading_status
+from modules.transport import encode_figure, register_figure_decoder
 from modules.messages import *
 
-from apps.messages.layout import get_tab1, get_tab2, get_tab3, get_tab4, get_tab5
+from apps.messages.layout import get_tab1, get_tab2, get_tab3, get_tab4, get_tab5, get_progress
 
-from config import MY_NAME
+from config import MY_NAME, PREFETCH_COUNT, FIGURE_POINTS
 
+# the artifacts (see modules/store.py) every tab and its callbacks need
+TAB_ARTIFACTS = {
+    "1": ('df', 'msg_counts'),
+    "2": ('df', 'chat_index', 'msg_counts', 'msg_counts_index', 'top_words'),
+    "3": ('df', 'token_index', 'contact_sketches'),
+    "4": ('G',),
+    "5": ('df_photos', 'photo_index'),
+}
 
-def register_callbacks(app, df, df_photos, G):
+
+def register_callbacks(app):
     # tab callbacks
 
     @app.callback(
-        Output('tab-output', 'children'),
-        [Input('tabs', 'value')])
-    def show_content(value):
+        [Output('tab-output', 'children'),
+         Output('loading-interval', 'disabled')],
+        [Input('tabs', 'value'),
+         Input('loading-interval', 'n_intervals')])
+    @timed
+    def show_content(value, n_intervals):
+        # the network graph is only built once its tab is opened
+        if not request_artifacts(*TAB_ARTIFACTS[value]):
+            status = loading_status(*TAB_ARTIFACTS[value])
+            # stop polling once something failed, it will not get ready anymore
+            return get_progress(status), any(step['state'] == 'failed' for step in status)
+
         if value == "1":
-            return html.Div(get_tab1(df))
+            return html.Div(get_tab1(get_artifact('df'))), True
         elif value == "2":
-            return html.Div(get_tab2(df))
+            return html.Div(get_tab2(get_artifact('df'))), True
         elif value == "3":
-            return html.Div(get_tab3(df))
+            return html.Div(get_tab3(get_artifact('df'))), True
         elif value == "4":
-            return html.Div(get_tab4(G))
+            return html.Div(get_tab4()), True
         elif value == "5":
-            return html.Div(get_tab5(df_photos))
+            return html.Div(get_tab5(get_artifact('df_photos'))), True
 
     # helper functionality
 
-    def generate_table_children(dataframe, max_rows=10):
-        return [
-            html.Thead(
-                html.Tr([html.Th(col) for col in dataframe.columns])
-            ),
-            html.Tbody([
-                html.Tr([
-                    html.Td(dataframe.iloc[i][col]) for col in dataframe.columns
-                ]) for i in range(min(len(dataframe), max_rows))
-            ])
-        ]
+    def get_page(page_current, page_size):
+        # the DataTables page on the server, see page_action='custom'
+        return slice(page_current * page_size, (page_current + 1) * page_size)
+
+    def get_window(relayout_data):
+        # only a change of the x axis needs new points
+        try:
+            return visible_range(relayout_data)
+        except KeyError:
+            if 'relayoutData' in dash.callback_context.triggered[0]['prop_id']:
+                raise PreventUpdate
+            return None
 
     # callbacks for content TAB 1
 
     @app.callback(
-        Output('sent-received-bar-graph', 'figure'),
-        [Input('global-timeframe-dropdown', 'value')]
+        Output('sent-received-bar-graph-data', 'data'),
+        [Input('global-timeframe-dropdown', 'value'),
+         Input('sent-received-bar-graph', 'relayoutData')]
     )
-    def update_global_sent_received(selected_timeframe):
+    @timed
+    def update_global_sent_received(selected_timeframe, relayout_data):
+        window = get_window(relayout_data)
         sent_received = get_msg_count_in_out(
-            df, selected_timeframe)
+            get_artifact('msg_counts'), selected_timeframe)
+        # min/max keeps the peaks that bars are read for
+        sent_received = downsample(sent_received, 'timestamp', 'msg_count', 'type',
+                                   FIGURE_POINTS, method='min_max', window=window)
 
         fig = px.bar(sent_received, x='timestamp', y='msg_count',
                      color='type', barmode='group', labels={'msg_count': '#messages', 'timestamp': 'Time'})
+        # keeps the zoom when the figure is redrawn
+        fig.update_layout(uirevision='sent-received')
 
-        return fig
+        return encode_figure(fig)
 
     # callbacks for content TAB 2
 
     @app.callback(
-        [Output('msg-count-lines', 'figure'),
-         Output('participants-pie-chart', 'figure'),
-         Output('top-words-table', 'children')],
+        Output('msg-count-lines-data', 'data'),
         [Input('chat-dropdown', 'value'),
-         Input('timeframe-dropdown', 'value')]
+         Input('timeframe-dropdown', 'value'),
+         Input('msg-count-lines', 'relayoutData')]
     )
-    def update_figure_and_table(selected_chat_title, selected_timeframe):
-        df_chat = filter_df_on_title(df, selected_chat_title)
-
-        most_used_words = {}
-        max_vocab_size = 0
-
-        for participant in df_chat.sender_name.unique().tolist():
-            wc = get_wordcount(df_chat.loc[df.sender_name == participant])
-            if len(wc) > max_vocab_size:
-                max_vocab_size = len(wc)
-            most_used_words[participant] = [
-                item[0] + f' ({item[1]})' for item in wc]
-
-        equal_size_columns = {}
-        for k, v in most_used_words.items():
-            col = [np.nan] * max_vocab_size
-            col[: len(v)] = v
-            equal_size_columns[k] = col
-
-        df_words = pd.DataFrame({k: v for k, v in equal_size_columns.items()})
-
-        aggs = get_msg_count_per_contact(df_chat, selected_timeframe)
+    @timed
+    def update_msg_count_lines(selected_chat_title, selected_timeframe, relayout_data):
+        window = get_window(relayout_data)
+        msg_counts = get_artifact('msg_counts')
+
+        aggs = get_msg_count_per_contact(
+            filter_df_on_title(msg_counts, selected_chat_title, get_artifact('msg_counts_index')), selected_timeframe)
+        aggs = downsample(aggs, 'timestamp', 'msg_count', 'sender_name',
+                          FIGURE_POINTS, window=window)
         figure = px.line(aggs, x="timestamp",
                          y="msg_count", color='sender_name')
+        figure.update_layout(uirevision='msg-count-lines')
+
+        return encode_figure(figure)
+
+    @app.callback(
+        Output('participants-pie-chart', 'figure'),
+        [Input('chat-dropdown', 'value')]
+    )
+    @timed
+    def update_participants_pie(selected_chat_title):
+        df_chat = filter_df_on_title(
+            get_artifact('df'), selected_chat_title, get_artifact('chat_index'))
 
         counts = get_total_msg_count_per_contact(df_chat)
 
@@ -115,15 +148,51 @@ def register_callbacks(app, df, df_photos, G):
                 'legend': {'x': 0, 'y': 1}
             }
         }
-        return (figure, figure_pie, generate_table_children(df_words, 10))
+        return figure_pie
+
+    @app.callback(
+        [Output('top-words-table', 'columns'),
+         Output('top-words-table', 'data'),
+         Output('top-words-table', 'page_count')],
+        [Input('chat-dropdown', 'value'),
+         Input('top-words-dates', 'start_date'),
+         Input('top-words-dates', 'end_date'),
+         Input('top-words-table', 'page_current'),
+         Input('top-words-table', 'page_size')]
+    )
+    @timed
+    def update_top_words(selected_chat_title, start_date, end_date, page_current, page_size):
+        df_chat = filter_df_on_title(
+            get_artifact('df'), selected_chat_title, get_artifact('chat_index'))
+        participants = df_chat.sender_name.unique().tolist()
+        page = get_page(page_current, page_size)
+
+        # only the words up to the visible page, and one more to know if there is a next page
+        columns = [{'name': '#', 'id': 'rank'}] + [
+            {'name': participant, 'id': f'participant-{i}'} for i, participant in enumerate(participants)]
+        rows = [{'rank': rank + 1} for rank in range(page.start, page.stop)]
+        more = False
+        for i, participant in enumerate(participants):
+            words = get_top_words(get_artifact('top_words'), selected_chat_title,
+                                  participant, page.stop + 1, start_date, end_date)
+            more |= len(words) > page.stop
+            for row, (word, count, error) in zip(rows, words[page]):
+                # words not among the most used of every month may have been used up to error more times
+                row[f'participant-{i}'] = f'{word} ({count}–{count + error})' if error else f'{word} ({count})'
+
+        # the summaries keep CAPACITY words per month, less frequent ones are not ranked
+        page_count = min(page_current + (2 if more else 1), CAPACITY // page_size)
+        return columns, rows, page_count
 
     @app.callback(
-        [Output('hourly-bars', 'figure'),
-         Output('weekly-bars', 'figure')],
+        [Output('hourly-bars-data', 'data'),
+         Output('weekly-bars-data', 'data')],
         [Input('chat-dropdown', 'value')]
     )
+    @timed
     def update_figures(selected_chat_title):
-        df_chat = filter_df_on_title(df, selected_chat_title)
+        df_chat = filter_df_on_title(
+            get_artifact('df'), selected_chat_title, get_artifact('chat_index'))
 
         dist_hourly = get_msg_distribution_per_contact(df_chat, 'Hour of Day')
         figure1 = px.bar(dist_hourly, x="timestamp",
@@ -133,16 +202,40 @@ def register_callbacks(app, df, df_photos, G):
         figure2 = px.bar(dist_weekly, x="timestamp",
                          y="msg_count", color='sender_name')
 
-        return (figure1, figure2)
+        return (encode_figure(figure1), encode_figure(figure2))
 
     # callbacks for content TAB 3
 
     @app.callback(
-        Output('contacts-table', 'children'),
-        [Input('contact-select-dropdown', 'value')]
+        [Output('contacts-table', 'data'),
+         Output('contacts-table', 'page_count')],
+        [Input('contact-select-dropdown', 'value'),
+         Input('contacts-table', 'page_current'),
+         Input('contacts-table', 'page_size'),
+         Input('contacts-table', 'sort_by')]
+    )
+    @timed
+    def update_contacts_table(selected_contacts, page_current, page_size, sort_by):
+        df = get_artifact('df')
+        # no selection lists everyone, the stats of all contacts are read from their sketches at once
+        stats = get_contact_stats(df, selected_contacts or list_contacts(df),
+                                  get_artifact('token_index'), get_artifact('contact_sketches'))
+        if sort_by:
+            stats = stats.sort_values(
+                sort_by[0]['column_id'], ascending=sort_by[0]['direction'] == 'asc', kind='mergesort')
+
+        page = stats.iloc[get_page(page_current, page_size)]
+        return page.to_dict('records'), max(math.ceil(len(stats) / page_size), 1)
+
+    # callbacks for content TAB 4
+
+    @app.callback(
+        Output('network-graph-data', 'data'),
+        [Input('graph-detail', 'value')]
     )
-    def update_contacts_table(selected_contacts):
-        return generate_table_children(get_contact_stats(df, selected_contacts))
+    @timed
+    def update_network_graph(selected_level):
+        return get_graph_payload(get_artifact('G'), selected_level)
 
     # callbacks for content TAB 5
 
@@ -152,31 +245,17 @@ def register_callbacks(app, df, df_photos, G):
          Output('my-slider', 'marks')],
         [Input('chat-dropdown-media', 'value')]
     )
+    @timed
     def update_slider_options(selected_chat_title):
-
-        photos_selection = filter_df_on_title(df_photos, selected_chat_title)
-        photos_selection = photos_selection.sort_values('timestamp')
-        list_of_filenames = photos_selection.photo_uri.tolist()
-
-        photos_selection['date'] = pd.to_datetime(photos_selection.timestamp.dt.date).dt.strftime(
-            '%d/%m/%Y')
-
-        daily_first = photos_selection.groupby('date').first(
-        ).reset_index()
-        combined = photos_selection.merge(
-            daily_first, on='photo_creation_timestamp', how='left')
-        idx_of_first_daily_msg = combined.loc[~combined.sender_name_y.isnull(
-        )].index.tolist()
-        date_of_first_daily_msg = combined.loc[~combined.sender_name_y.isnull(
-        )].date_y.tolist()
+        photos = get_artifact('photo_index')[selected_chat_title]
 
         value = 0
-        max_value = len(list_of_filenames)-1
+        max_value = len(photos['ids'])-1
         marks = {value:
                  {'label': date,
                   'style':
                   {"transform": "rotate(90deg)", 'float': 'left', 'margin-left': '-35px', 'margin-top': '20px'}}
-                 for value, date in zip(idx_of_first_daily_msg, date_of_first_daily_msg)
+                 for value, date in photos['marks'].items()
                  }
 
         return value, max_value, marks
@@ -189,25 +268,43 @@ def register_callbacks(app, df, df_photos, G):
         [Input('chat-dropdown-media', 'value'),
          Input('my-slider', 'value')]
     )
+    @timed
     def update_image(selected_chat_title, slider_value):
-
-        photos_selection = filter_df_on_title(df_photos, selected_chat_title)
-        photos_selection = photos_selection.sort_values('timestamp')
-        list_of_filenames = photos_selection.photo_uri.tolist()
-
-        photos = html.Img(src='data:image/jpg;base64,{}'.format(read_image(list_of_filenames[int(slider_value)]).decode()),
-                          style={
+        photos = get_artifact('photo_index')[selected_chat_title]
+        slider_value = int(slider_value)
+
+        photo_id = photos['ids'][slider_value]
+        filename = photos['uris'][slider_value]
+        image = html.A(href=get_media_url(photo_id, filename, 'original'), target='_blank', children=html.Img(
+                       src=get_media_url(photo_id, filename, 'preview'),
+                       style={
             'height': '600px',
             'margin-left': 'auto',
             'margin-right': 'auto',
             'margin-bottom': '20px',
             'display': 'block'
         }
+        ))
+
+        # warm the neighbours on the server, and let the browser preload them into its cache
+        neighbours = slice(max(slider_value - PREFETCH_COUNT, 0),
+                           slider_value + PREFETCH_COUNT + 1)
+        prefetch_media(photos['uris'][neighbours])
+        preload = html.Div(children=[
+            html.Img(src=get_media_url(neighbour_id, neighbour, 'preview'))
+            for neighbour_id, neighbour in zip(photos['ids'][neighbours], photos['uris'][neighbours])
+            if neighbour_id != photo_id
+        ],
+            style={'display': 'none'}
         )
 
-        text = photos_selection.iloc[slider_value].sender_name
+        text = photos['senders'][slider_value]
+
+        date = photos['dates'][slider_value]
+
+        return [image, preload], text, date, str(len(photos['ids'])) + ' photos sent/received'
 
-        date = photos_selection.timestamp.dt.strftime(
-            '%d-%m-%Y %H:%M').iloc[slider_value]
+    # figures that callbacks send encoded, see modules/transport.py
 
-        return photos, text, date, str(len(list_of_filenames)) + ' photos sent/received'
+    for graph_id in ['sent-received-bar-graph', 'msg-count-lines', 'hourly-bars', 'weekly-bars', 'network-graph']:
+        register_figure_decoder(app, graph_id)
@@ -3,13 +3,17 @@ import logging
 import plotly.express as px
 import dash_core_components as dcc
 import dash_html_components as html
+import dash_table
+from dash_table.Format import Format, Scheme
 
-from modules.network import plot_graph
+from modules.network import DETAIL_LEVELS
 from modules.messages import *
+from modules.memo import memoize
 
-from config import MY_NAME
+from config import MY_NAME, CONTACTS_PAGE_SIZE, TOP_WORDS_PAGE_SIZE
 
 
+@memoize
 def get_layout(df):
     total_sent = len(df.loc[df.sender_name == MY_NAME])
     total_received = len(df.loc[df.sender_name != MY_NAME])
@@ -33,11 +37,34 @@ def get_layout(df):
             value="1",
             id='tabs'
         ),
-        html.Div(id='tab-output')
+        html.Div(id='tab-output'),
+        # polls while the selected tab waits for its data
+        dcc.Interval(id='loading-interval', interval=1000, disabled=True),
     ])
     return layout
 
 
+def get_progress(status):
+    """Shows the state of the steps a page waits for, status as returned by loading_status"""
+
+    ready = sum(step['state'] == 'ready' for step in status)
+    items = []
+    for step in status:
+        text = f'{", ".join(step["names"])}: {step["state"]}'
+        if step['seconds'] is not None:
+            text += f' ({step["seconds"]:.0f} s)'
+        if step['error']:
+            text += f' - {step["error"]}'
+        items.append(html.Li(text))
+
+    return html.Div(children=[
+        html.H4('Loading...' if not any(step['error'] for step in status) else 'Loading failed'),
+        html.Progress(value=str(ready), max=str(len(status))),
+        html.Ul(items),
+    ])
+
+
+@memoize
 def get_tab1(df):
 
     contact_counts = get_total_msg_count_per_contact(df)
@@ -54,6 +81,7 @@ def get_tab1(df):
             value='Monthly'
         ),
         dcc.Graph(id='sent-received-bar-graph'),
+        dcc.Store(id='sent-received-bar-graph-data'),
 
         html.H4('Weekly activity'),
         dcc.Graph(
@@ -83,6 +111,7 @@ def get_tab1(df):
     return tab1
 
 
+@memoize
 def get_tab2(df):
     tab2 = [
 
@@ -113,6 +142,7 @@ def get_tab2(df):
         ]),
 
         dcc.Graph(id='msg-count-lines'),
+        dcc.Store(id='msg-count-lines-data'),
 
         html.Div(children=[
             dcc.Graph(style={'width': '49%', 'display': 'inline-block'},
@@ -121,57 +151,86 @@ def get_tab2(df):
             dcc.Graph(style={'width': '49%', 'display': 'inline-block'},
                       id='weekly-bars'),
         ]),
+        dcc.Store(id='hourly-bars-data'),
+        dcc.Store(id='weekly-bars-data'),
 
 
         html.H4('#Messages per participant'),
         dcc.Graph(id='participants-pie-chart'),
 
         html.H4('Top words per participant'),
-        html.Table(id='top-words-table'),
+        html.Label('Select a period (whole months)'),
+        dcc.DatePickerRange(id='top-words-dates',
+                            min_date_allowed=df.timestamp.min().date(),
+                            max_date_allowed=df.timestamp.max().date(),
+                            display_format='DD-MM-YYYY',
+                            clearable=True),
+        dash_table.DataTable(id='top-words-table',
+                             page_action='custom',
+                             page_current=0,
+                             page_size=TOP_WORDS_PAGE_SIZE),
 
     ]
     return tab2
 
 
+@memoize
 def get_tab3(df):
     all_contacts = list_contacts(df)
 
     tab3 = [
 
         html.H4('Stats per contact'),
-        html.Label('Select one or more contacts'),
+        html.Label('Select one or more contacts, or none to list everyone'),
         dcc.Dropdown(id='contact-select-dropdown',
                      options=[
                         {'label': contact, 'value': contact} for contact in all_contacts],
-                     value=all_contacts[:5],
+                     value=[],
                      multi=True
                      ),
 
-        html.Table(id='contacts-table'),
+        dash_table.DataTable(id='contacts-table',
+                             columns=[
+                                 {'name': 'Name', 'id': 'Name'},
+                                 {'name': 'Message Count', 'id': 'Message Count', 'type': 'numeric'},
+                                 {'name': 'Vocab. size', 'id': 'Vocab. size', 'type': 'numeric'},
+                                 {'name': 'Avg. word length', 'id': 'Avg. word length', 'type': 'numeric',
+                                  'format': Format(precision=2, scheme=Scheme.fixed)},
+                                 {'name': 'Avg. words per msg', 'id': 'Avg. words per msg', 'type': 'numeric',
+                                  'format': Format(precision=2, scheme=Scheme.fixed)},
+                             ],
+                             page_action='custom',
+                             page_current=0,
+                             page_size=CONTACTS_PAGE_SIZE,
+                             sort_action='custom',
+                             sort_mode='single',
+                             sort_by=[{'column_id': 'Message Count', 'direction': 'desc'}]),
     ]
     return tab3
 
 
-def get_tab4(G):
-    fig = plot_graph(G)
+@memoize
+def get_tab4():
 
     tab4 = [
         html.H4('Network Interactions'),
-        dcc.Graph(
-            figure=fig,
-        ),
+        html.Label('Level of detail'),
+        dcc.RadioItems(id='graph-detail',
+                       options=[
+                           {'label': level, 'value': level} for level in DETAIL_LEVELS
+                       ],
+                       value='Medium',
+                       labelStyle={'display': 'inline-block'}
+                       ),
+        dcc.Graph(id='network-graph'),
+        dcc.Store(id='network-graph-data'),
     ]
     return tab4
 
 
+@memoize
 def get_tab5(df_photos):
 
-    photos_selection = filter_df_on_title(
-        df_photos,  list_chat_titles(df_photos)[0])
-
-    photos_selection = photos_selection.sort_values('timestamp')
-    list_of_filenames = photos_selection.photo_uri.tolist()
-
     tab5 = [
         html.Label('Select a chat'),
         dcc.Dropdown(id='chat-dropdown-media',
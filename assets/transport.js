@@ -0,0 +1,57 @@
+// Decodes the figures encoded by modules/transport.py: every {dtype, bdata} object
+// (with an optional offset and scale) becomes a typed array, which plotly.js draws like a plain array.
+(function () {
+    var TYPED_ARRAYS = {
+        u1: Uint8Array,
+        u2: Uint16Array,
+        u4: Uint32Array,
+        f4: Float32Array,
+        f8: Float64Array
+    };
+
+    function decodeArray(encoded) {
+        var binary = window.atob(encoded.bdata);
+        var bytes = new Uint8Array(binary.length);
+        for (var i = 0; i < binary.length; i++) {
+            bytes[i] = binary.charCodeAt(i);
+        }
+        var values = new TYPED_ARRAYS[encoded.dtype](bytes.buffer);
+        if (encoded.offset === undefined) {
+            return values;
+        }
+        // integers counted from their minimum, e.g. dates in milliseconds
+        var result = new Float64Array(values.length);
+        for (var j = 0; j < values.length; j++) {
+            result[j] = encoded.offset + encoded.scale * values[j];
+        }
+        return result;
+    }
+
+    function decode(value) {
+        if (Array.isArray(value)) {
+            return value.map(decode);
+        }
+        if (value === null || typeof value !== 'object') {
+            return value;
+        }
+        if (typeof value.bdata === 'string' && TYPED_ARRAYS[value.dtype]) {
+            return decodeArray(value);
+        }
+        var result = {};
+        Object.keys(value).forEach(function (key) {
+            result[key] = decode(value[key]);
+        });
+        return result;
+    }
+
+    window.dash_clientside = Object.assign({}, window.dash_clientside, {
+        transport: {
+            decode_figure: function (figure) {
+                if (!figure) {
+                    return {data: [], layout: {}};
+                }
+                return decode(figure);
+            }
+        }
+    });
+})();
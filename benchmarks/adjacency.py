@@ -0,0 +1,66 @@
+"""Compares time and peak memory of the sparse adjacency matrix against the original merge based version.
+
+Run from the repository root:
+
+    python -m benchmarks.adjacency
+"""
+import time
+import logging
+import tracemalloc
+
+import numpy as np
+
+from modules.dataloader import load_data
+from modules.messages import get_sparse_adjacency_matrix, get_weighted_adjacency_matrix
+
+logging.basicConfig(level=logging.INFO)
+
+
+def merge_adjacency_matrix(df):
+    """The original implementation, kept here as the reference"""
+
+    msgs_per_sender_per_title = df.groupby(['sender_name', 'title'], observed=True).size(
+    ).reset_index().rename(columns={0: 'msg_count'})
+
+    receivers_per_title = df[['title', 'sender_name']].rename(
+        columns={'sender_name': 'receiver_name'})
+
+    combined = msgs_per_sender_per_title.merge(receivers_per_title, on='title')
+    combined = combined[combined['sender_name'] !=
+                        combined['receiver_name']].drop_duplicates().drop(columns='title')
+
+    connectivity = combined.groupby(['sender_name', 'receiver_name'], observed=True)[
+        'msg_count'].sum().unstack().sort_index().sort_index(axis=1)
+
+    return connectivity.columns.tolist(), connectivity.values
+
+
+def measure(func, df):
+    tracemalloc.start()
+    t0 = time.time()
+    result = func(df)
+    duration = time.time() - t0
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, duration, peak
+
+
+def main():
+    df, _ = load_data()
+
+    results = {}
+    for name, func in [('merge', merge_adjacency_matrix),
+                       ('sparse', get_sparse_adjacency_matrix),
+                       ('sparse (dense output)', get_weighted_adjacency_matrix)]:
+        results[name], duration, peak = measure(func, df)
+        logging.info(
+            f'{name:>22}: {duration:8.3f} seconds, peak memory {peak / 2**20:8.1f} MiB')
+
+    names, expected = results['merge']
+    assert names == results['sparse (dense output)'][0]
+    np.testing.assert_array_equal(expected, results['sparse (dense output)'][1])
+    logging.info(f'All versions agree on {len(names)} contacts.')
+
+
+if __name__ == '__main__':
+    main()
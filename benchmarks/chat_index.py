@@ -0,0 +1,61 @@
+"""Compares selecting chats and senders with boolean masks against slicing with the chat index.
+
+Run from the repository root:
+
+    python -m benchmarks.chat_index
+"""
+import time
+import logging
+
+import pandas.testing
+
+from modules.dataloader import load_data
+from modules.messages import build_chat_index, filter_df_on_title, filter_df_on_sender, list_chat_titles
+
+logging.basicConfig(level=logging.INFO)
+
+# bypass the memoization, every selection has to be computed
+filter_on_title = filter_df_on_title.__wrapped__
+filter_on_sender = filter_df_on_sender.__wrapped__
+
+
+def select_all(df, titles, chat_index=None):
+    """Selects every chat, and every sender within it, the way update_figure_and_table does"""
+
+    for title in titles:
+        df_chat = filter_on_title(df, title, chat_index)
+        for sender in df_chat.sender_name.unique().tolist():
+            if chat_index is None:
+                df_chat.loc[df_chat.sender_name == sender]
+            else:
+                filter_on_sender(df, sender, title, chat_index)
+
+
+def main():
+    df, _ = load_data()
+    titles = list_chat_titles(df)
+
+    t0 = time.time()
+    chat_index = build_chat_index(df)
+    logging.info(
+        f'Building the chat index took {time.time()-t0:.4f} seconds.')
+
+    for title in titles:
+        pandas.testing.assert_frame_equal(
+            filter_on_title(df, title), filter_on_title(df, title, chat_index))
+
+    t0 = time.time()
+    select_all(df, titles)
+    masks = time.time() - t0
+
+    t0 = time.time()
+    select_all(df, titles, chat_index)
+    slices = time.time() - t0
+
+    logging.info(
+        f'Selecting {len(titles)} chats and their senders: masks {masks:.4f} seconds, '
+        f'index {slices:.4f} seconds ({masks / max(slices, 1e-9):.1f}x faster).')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,91 @@
+"""Compares the throughput of parsing the raw message files with per-message decoding against the decoding stage.
+
+Best run on a large export, e.g. a synthetic one (see benchmarks/synthetic.py). From the repository root:
+
+    DATA_DIR=benchmarks/data/1m/data python -m benchmarks.decoding
+"""
+import os
+import time
+import logging
+import tracemalloc
+
+from modules.dataloader import TEXT_COLUMNS, PHOTO_COLUMNS, _list_shards, _load_messages, _parse_shard
+from config import DATA_DIR
+
+logging.basicConfig(level=logging.INFO)
+
+
+def per_message_parse_shard(shard):
+    """The original implementation, kept here as the reference"""
+
+    chat_id, filename = shard
+    data = _load_messages(filename)
+    title = data['title'].encode('latin1').decode('utf8')
+
+    text = {col: [] for col in TEXT_COLUMNS}
+    photos = {col: [] for col in PHOTO_COLUMNS}
+
+    for msg in data['messages']:
+        sender_name = msg['sender_name'].encode('latin1').decode('utf8')
+        if 'content' in msg.keys():
+            text['timestamp'].append(msg['timestamp_ms'])
+            text['sender_name'].append(sender_name)
+            text['content'].append(
+                msg['content'].encode('latin1').decode('utf8'))
+        if 'photos' in msg.keys():
+            for item in msg.get('photos'):
+                photos['timestamp'].append(msg['timestamp_ms'])
+                photos['sender_name'].append(sender_name)
+                photos['photo_uri'].append(
+                    os.path.join(DATA_DIR, item['uri']))
+                photos['photo_creation_timestamp'].append(
+                    item['creation_timestamp'])
+
+    for buffers in (text, photos):
+        n = len(buffers['timestamp'])
+        buffers['chat_id'] = [chat_id] * n
+        buffers['title'] = [title] * n
+
+    return text, photos
+
+
+def measure(parse, shards):
+    t0 = time.perf_counter()
+    results = [parse(shard) for shard in shards]
+    seconds = time.perf_counter() - t0
+
+    # memory held by the parsed columns: interned names are stored once instead of once per message
+    tracemalloc.start()
+    retained = [parse(shard) for shard in shards]
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del retained
+    return results, seconds, size
+
+
+def main():
+    shards = _list_shards()
+    size = sum(os.path.getsize(filename) for _, filename in shards)
+
+    # parsing the json alone, the part both versions share
+    t0 = time.perf_counter()
+    messages = sum(len(_load_messages(filename)['messages'])
+                   for _, filename in shards)
+    json_seconds = time.perf_counter() - t0
+
+    expected, before, before_size = measure(per_message_parse_shard, shards)
+    results, after, after_size = measure(_parse_shard, shards)
+    assert results == expected, 'the decoding stage changed the parsed columns'
+
+    for name, seconds, columns in [('per message', before, before_size), ('decoding stage', after, after_size)]:
+        logging.info(
+            f'{name:>15}: {seconds:7.3f} seconds, {messages / seconds:10.0f} messages/s, '
+            f'{size / 2**20 / seconds:6.1f} MiB/s, of which {seconds - json_seconds:.3f} seconds after json parsing, '
+            f'columns take {columns / 2**20:.1f} MiB')
+    logging.info(
+        f'{len(shards)} files, {messages} messages, {size / 2**20:.1f} MiB: '
+        f'{(before - json_seconds) / max(after - json_seconds, 1e-9):.1f}x faster after json parsing.')
+
+
+if __name__ == '__main__':
+    main()
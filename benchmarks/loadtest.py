@@ -0,0 +1,184 @@
+"""Measures callback throughput and memory of the production server for several worker counts.
+
+Starts `gunicorn -c gunicorn.conf.py wsgi:server` once per worker count and replays a mix of
+Dash callback requests from concurrent clients. Run from the repository root:
+
+    python -m benchmarks.loadtest --workers 1 2 4 8 --clients 16 --requests 400
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+
+from modules.dataloader import load_data
+from modules.messages import list_chat_titles
+
+
+def callback_request(outputs, inputs):
+    """Body of a Dash callback request, as the renderer sends it"""
+
+    ids = [{'id': output.split('.')[0], 'property': output.split('.')[1]}
+           for output in outputs]
+    multi = len(outputs) > 1
+    return {
+        'output': '..' + '...'.join(outputs) + '..' if multi else outputs[0],
+        'outputs': ids if multi else ids[0],
+        'inputs': [{'id': id, 'property': prop, 'value': value} for id, prop, value in inputs],
+        'changedPropIds': [f'{id}.{prop}' for id, prop, _ in inputs],
+    }
+
+
+def build_requests(titles, n, seed=0):
+    random.seed(seed)
+    mix = []
+    for _ in range(n):
+        kind = random.randrange(4)
+        timeframe = random.choice(['Hourly', 'Daily', 'Monthly', 'Yearly'])
+        title = random.choice(titles)
+        # zoomed to a random month of 2019, or showing everything
+        month = random.randrange(1, 13)
+        zoom = random.choice([None, {'xaxis.range[0]': f'2019-{month:02d}-01',
+                                     'xaxis.range[1]': f'2019-{month:02d}-28'}])
+        page = random.randrange(3)
+        if kind == 0:
+            mix.append(callback_request(['sent-received-bar-graph-data.data'], [
+                ('global-timeframe-dropdown', 'value', timeframe), ('sent-received-bar-graph', 'relayoutData', zoom)]))
+        elif kind == 1:
+            mix.append(callback_request(['msg-count-lines-data.data'], [
+                ('chat-dropdown', 'value', title), ('timeframe-dropdown', 'value', timeframe),
+                ('msg-count-lines', 'relayoutData', zoom)]))
+            mix.append(callback_request(['participants-pie-chart.figure'], [
+                ('chat-dropdown', 'value', title)]))
+            mix.append(callback_request(['top-words-table.columns', 'top-words-table.data', 'top-words-table.page_count'], [
+                ('chat-dropdown', 'value', title), ('top-words-dates', 'start_date', None),
+                ('top-words-dates', 'end_date', None), ('top-words-table', 'page_current', page),
+                ('top-words-table', 'page_size', 10)]))
+        elif kind == 2:
+            mix.append(callback_request(['hourly-bars-data.data', 'weekly-bars-data.data'], [
+                ('chat-dropdown', 'value', title)]))
+        else:
+            # a page of all contacts, sorted on a random column
+            column = random.choice(['Name', 'Message Count', 'Vocab. size'])
+            mix.append(callback_request(['contacts-table.data', 'contacts-table.page_count'], [
+                ('contact-select-dropdown', 'value', []), ('contacts-table', 'page_current', page),
+                ('contacts-table', 'page_size', 20),
+                ('contacts-table', 'sort_by', [{'column_id': column, 'direction': random.choice(['asc', 'desc'])}])]))
+    return mix
+
+
+def _children(pid):
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            return [int(child) for child in f.read().split()]
+    except OSError:
+        return []
+
+
+def _memory_kib(pid, field):
+    """Reads a field like Rss or Pss (proportional, shared pages split over their users) from /proc"""
+
+    try:
+        with open(f'/proc/{pid}/smaps_rollup') as f:
+            for line in f:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1])
+    except OSError:
+        pass
+    return 0
+
+
+def _pss_kib(parent):
+    """PSS of a process and its children, the memory they use together"""
+
+    return sum(_memory_kib(pid, 'Pss') for pid in [parent] + _children(parent))
+
+
+def wait_until_up(url, process, timeout):
+    t0 = time.time()
+    while time.time() - t0 < timeout:
+        if process.poll() is not None:
+            raise RuntimeError('gunicorn exited during startup')
+        try:
+            requests.get(url, timeout=1)
+            return
+        except requests.ConnectionError:
+            time.sleep(0.5)
+    raise RuntimeError(f'server did not come up within {timeout} seconds')
+
+
+def run(workers, payloads, clients, port, startup_timeout):
+    env = dict(os.environ, WEB_CONCURRENCY=str(workers),
+               BIND=f'127.0.0.1:{port}')
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '-c', 'gunicorn.conf.py', 'wsgi:server'], env=env)
+    url = f'http://127.0.0.1:{port}'
+
+    try:
+        wait_until_up(url, process, startup_timeout)
+        session = requests.Session()
+        idle = _pss_kib(process.pid)
+
+        def send(payload):
+            t0 = time.time()
+            response = session.post(
+                f'{url}/_dash-update-component', json=payload)
+            response.raise_for_status()
+            return time.time() - t0
+
+        # a full pass first, so the memo and media caches of every worker are filled
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            list(executor.map(send, payloads))
+
+        t0 = time.time()
+        with ThreadPoolExecutor(max_workers=clients) as executor:
+            latencies = np.array(list(executor.map(send, payloads)))
+        duration = time.time() - t0
+
+        pids = [process.pid] + _children(process.pid)
+        rss = sum(_memory_kib(pid, 'Rss') for pid in pids)
+        pss = _pss_kib(process.pid)
+    finally:
+        process.terminate()
+        process.wait()
+
+    return {
+        'workers': workers,
+        'throughput': len(payloads) / duration,
+        'p50': np.percentile(latencies, 50) * 1000,
+        'p95': np.percentile(latencies, 95) * 1000,
+        'rss': rss / 2**10,
+        'idle_pss': idle / 2**10,
+        'pss': pss / 2**10,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4])
+    parser.add_argument('--clients', type=int, default=8)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--port', type=int, default=8051)
+    parser.add_argument('--startup-timeout', type=int, default=600)
+    args = parser.parse_args()
+
+    df, _ = load_data()
+    payloads = build_requests(list_chat_titles(df), args.requests)
+    del df
+
+    # memory right after startup, and after the requests with warm caches
+    print(f'{"workers":>8} {"req/s":>8} {"p50 ms":>8} {"p95 ms":>8} {"RSS MiB":>9} {"idle PSS":>9} {"PSS MiB":>9}')
+    for workers in args.workers:
+        result = run(workers, payloads, args.clients,
+                     args.port, args.startup_timeout)
+        print(f'{result["workers"]:>8} {result["throughput"]:>8.1f} {result["p50"]:>8.1f} '
+              f'{result["p95"]:>8.1f} {result["rss"]:>9.1f} {result["idle_pss"]:>9.1f} {result["pss"]:>9.1f}')
+
+
+if __name__ == '__main__':
+    main()
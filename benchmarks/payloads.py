@@ -0,0 +1,55 @@
+"""Reports the response size of every callback: plain JSON figures against binary ones, both before and after compression.
+
+Best run on a large export, e.g. a synthetic one (see benchmarks/synthetic.py). From the repository root:
+
+    DATA_DIR=benchmarks/data/1m/data MY_NAME='Mark Zuckerberg' python -m benchmarks.payloads
+"""
+import logging
+from collections import defaultdict
+
+import numpy as np
+
+import index  # defines the layout, callbacks and artifacts
+from app import app
+from modules import transport
+from modules.messages import list_chat_titles
+from modules.store import get_artifact, wait_for_all
+from benchmarks.loadtest import callback_request, build_requests
+
+REQUESTS = 40
+
+
+def response_sizes(payloads):
+    """Bytes of every response per callback output, uncompressed and gzipped"""
+
+    client = app.server.test_client()
+    sizes = defaultdict(lambda: ([], []))
+    for payload in payloads:
+        plain = client.post('/_dash-update-component', json=payload)
+        gzipped = client.post('/_dash-update-component', json=payload,
+                              headers={'Accept-Encoding': 'gzip'})
+        assert plain.status_code == 200, plain.data[:200]
+        sizes[payload['output']][0].append(len(plain.data))
+        sizes[payload['output']][1].append(len(gzipped.data))
+    return sizes
+
+
+def main():
+    wait_for_all()
+    payloads = build_requests(list_chat_titles(get_artifact('df')), REQUESTS)
+    payloads += [callback_request(['network-graph-data.data'], [('graph-detail', 'value', level)])
+                 for level in ['Full', 'Medium']]
+
+    transport.BINARY_FIGURES = False
+    before = response_sizes(payloads)
+    transport.BINARY_FIGURES = True
+    after = response_sizes(payloads)
+
+    logging.info('Mean response KiB per callback: JSON, JSON gzipped, binary, binary gzipped')
+    for output in before:
+        kib = [np.mean(sizes) / 2**10 for sizes in before[output] + after[output]]
+        logging.info(f'{output:>60}: {kib[0]:9.1f} {kib[1]:9.1f} {kib[2]:9.1f} {kib[3]:9.1f}')
+
+
+if __name__ == '__main__':
+    main()
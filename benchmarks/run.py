@@ -0,0 +1,269 @@
+"""Records time and peak memory of every stage, from parsing to callbacks, on synthetic exports.
+
+Generates an export per scale (see benchmarks/synthetic.py) in benchmarks/data, measures every stage
+in a fresh process and compares the results against benchmarks/baseline.json. Run from the repository root:
+
+    python -m benchmarks.run --scales 10k 1m 10m
+    python -m benchmarks.run --scales 10k 1m --save-baseline
+
+Exits with status 1 when a stage got slower or needs more memory than the baseline allows.
+Peak memory is the growth of the resident set during a stage (Linux only), the processes
+parsing the raw files in parallel are not included.
+"""
+import gc
+import os
+import sys
+import json
+import time
+import shutil
+import inspect
+import logging
+import argparse
+import subprocess
+
+import numpy as np
+import dash
+
+from benchmarks.synthetic import SYNTHETIC_NAME, generate
+from benchmarks.loadtest import build_requests
+from modules.dataloader import load_data
+from modules.messages import *
+from modules.tokens import build_token_index
+from modules.network import build_graph, plot_graph
+from modules.media import build_photo_index
+from modules.sketches import build_contact_sketches
+from modules.topwords import build_top_words, get_top_words
+from modules.store import define_artifact, wait_for_all
+from apps.messages import layout as msg_layout
+from apps.messages import callbacks as msg_callbacks
+from config import CACHE_DIR
+
+BENCHMARK_DIR = os.path.dirname(os.path.abspath(__file__))
+DATA_ROOT = os.path.join(BENCHMARK_DIR, 'data')
+BASELINE = os.path.join(BENCHMARK_DIR, 'baseline.json')
+
+SCALES = {
+    '10k': dict(messages=10000, chats=50),
+    '1m': dict(messages=1000000, chats=500),
+    '10m': dict(messages=10000000, chats=2000),
+}
+CALLBACK_REQUESTS = 100
+
+# differences below these are noise, whatever the relative change
+MIN_SECONDS = 0.05
+MIN_PEAK_MIB = 5
+
+
+def _status_kib(field):
+    with open('/proc/self/status') as f:
+        for line in f:
+            if line.startswith(field + ':'):
+                return int(line.split()[1])
+    return 0
+
+
+def _reset_peak():
+    """Resets VmHWM, the peak resident set size of this process"""
+
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+        return True
+    except OSError:
+        return False
+
+
+def measure(results, name, func, *args):
+    gc.collect()
+    start = _status_kib('VmRSS')
+    reset = _reset_peak()
+
+    t0 = time.perf_counter()
+    result = func(*args)
+    seconds = time.perf_counter() - t0
+
+    peak = (_status_kib('VmHWM') - start) / 2**10 if reset else None
+    results[name] = {'seconds': seconds, 'peak_mib': peak}
+    logging.info(f'{name}: {seconds:.4f} seconds, peak memory +{peak or 0:.1f} MiB')
+    return result
+
+
+def _unmemoized(func):
+    # timed and memoize both set __wrapped__
+    return inspect.unwrap(func)
+
+
+def replay_callbacks(app, payloads):
+    """Sends callback requests to the app through the Flask test client, returns the latencies"""
+
+    client = app.server.test_client()
+    latencies = []
+    for payload in payloads:
+        t0 = time.perf_counter()
+        response = client.post('/_dash-update-component', json=payload)
+        latencies.append(time.perf_counter() - t0)
+        assert response.status_code == 200, response.data[:200]
+    return np.array(latencies)
+
+
+def measure_stages():
+    """Runs every stage on DATA_DIR, in this process"""
+
+    results = {}
+    shutil.rmtree(CACHE_DIR, ignore_errors=True)
+
+    measure(results, 'load_data (parse)', load_data)
+    df, df_photos = measure(results, 'load_data (cache)', load_data)
+    results['messages'] = len(df)
+
+    chat_index = measure(results, 'build_chat_index', build_chat_index, df)
+    msg_counts = measure(results, 'get_hourly_msg_counts', get_hourly_msg_counts, df)
+    msg_counts_index = build_chat_index(msg_counts)
+    token_index = measure(results, 'build_token_index', build_token_index, df, words_to_ignore)
+    sketches = measure(results, 'build_contact_sketches', build_contact_sketches, df, token_index)
+    top_words = measure(results, 'build_top_words', build_top_words, df, token_index)
+
+    # the largest chat, as selected in the Chat analysis tab
+    title = df.title.value_counts().index[0]
+    df_chat = _unmemoized(filter_df_on_title)(df, title, chat_index)
+    contacts = _unmemoized(list_contacts)(df)[:10]
+
+    for name, func, args in [
+            ('get_msg_count_in_out', get_msg_count_in_out, (msg_counts, 'Daily')),
+            ('get_weekly_activity_pattern', get_weekly_activity_pattern, (df,)),
+            ('get_total_msg_count_per_contact', get_total_msg_count_per_contact, (df,)),
+            ('get_msg_count_per_contact', get_msg_count_per_contact, (msg_counts, 'Daily')),
+            ('get_msg_distribution_per_contact', get_msg_distribution_per_contact, (df_chat, 'Hour of Day')),
+            ('get_wordcount', get_wordcount, (df, token_index)),
+            ('get_top_words', get_top_words, (top_words, title, df_chat.sender_name.iloc[0])),
+            ('get_contact_stats', get_contact_stats, (df, contacts, token_index, sketches)),
+            ('get_contact_stats (exact)', get_contact_stats, (df, contacts, token_index))]:
+        measure(results, name, _unmemoized(func), *args)
+
+    names, adjacency = measure(
+        results, 'get_sparse_adjacency_matrix', get_sparse_adjacency_matrix, df)
+    measure(results, 'get_weighted_adjacency_matrix',
+            get_weighted_adjacency_matrix, df)
+    G = measure(results, 'build_graph', build_graph, adjacency, names)
+    for level in ['Full', 'Medium']:
+        measure(results, f'plot_graph ({level})', _unmemoized(plot_graph), G, level)
+    photo_index = measure(results, 'build_photo_index', build_photo_index, df_photos)
+
+    app = dash.Dash(__name__)
+    app.config.suppress_callback_exceptions = True
+    app.layout = msg_layout.get_layout(df)
+    msg_callbacks.register_callbacks(app)
+    # the callbacks read their data from the store, hand them what was built above
+    for name, value in [('df', df), ('df_photos', df_photos), ('G', G), ('msg_counts', msg_counts),
+                        ('token_index', token_index), ('photo_index', photo_index),
+                        ('chat_index', chat_index), ('msg_counts_index', msg_counts_index),
+                        ('contact_sketches', sketches), ('top_words', top_words)]:
+        define_artifact(name, lambda value=value: value)
+    wait_for_all()
+    payloads = build_requests(_unmemoized(list_chat_titles)(df), CALLBACK_REQUESTS)
+    latencies = measure(results, 'callbacks', replay_callbacks, app, payloads)
+    results['callbacks']['p95_ms'] = np.percentile(latencies, 95) * 1000
+
+    return results
+
+
+def prepare_data(scale):
+    """Generates the synthetic export of a scale, unless it exists already, returns its DATA_DIR"""
+
+    data_dir = os.path.join(DATA_ROOT, scale, 'data')
+    marker = os.path.join(DATA_ROOT, scale, 'settings.json')
+    settings = SCALES[scale]
+    if os.path.exists(marker):
+        with open(marker) as f:
+            if json.load(f) == settings:
+                return data_dir
+
+    shutil.rmtree(os.path.join(DATA_ROOT, scale), ignore_errors=True)
+    logging.info(f'Generating the {scale} export in {data_dir}.')
+    generate(data_dir, **settings)
+    with open(marker, 'w') as f:
+        json.dump(settings, f)
+    return data_dir
+
+
+def run_scale(scale):
+    """Measures all stages of a scale in a fresh process, DATA_DIR is read by config.py on import"""
+
+    data_dir = prepare_data(scale)
+    output = os.path.join(DATA_ROOT, scale, 'results.json')
+    env = dict(os.environ, DATA_DIR=data_dir, MY_NAME=SYNTHETIC_NAME)
+    subprocess.run([sys.executable, '-m', 'benchmarks.run', '--measure', output],
+                   env=env, check=True)
+    with open(output) as f:
+        return json.load(f)
+
+
+def compare(scale, results, baseline, tolerance):
+    """Prints every stage next to its baseline, returns the stages that regressed"""
+
+    regressions = []
+    print(f'\n{scale} ({results["messages"]} messages)')
+    print(f'{"stage":>34} {"seconds":>9} {"baseline":>9} {"peak MiB":>9} {"baseline":>9}')
+    for stage, result in results.items():
+        if stage == 'messages':
+            continue
+        expected = baseline.get(stage, {})
+        flags = []
+        for metric, floor in [('seconds', MIN_SECONDS), ('peak_mib', MIN_PEAK_MIB)]:
+            value, reference = result.get(metric), expected.get(metric)
+            if value is not None and reference is not None and \
+                    value > reference * (1 + tolerance) and value - reference > floor:
+                flags.append(metric)
+        if flags:
+            regressions.append((scale, stage, flags))
+
+        def cell(value):
+            return f'{value:>9.3f}' if value is not None else f'{"-":>9}'
+        print(f'{stage:>34} {cell(result["seconds"])} {cell(expected.get("seconds"))} '
+              f'{cell(result["peak_mib"])} {cell(expected.get("peak_mib"))}'
+              f'{"  REGRESSION: " + ", ".join(flags) if flags else ""}')
+    return regressions
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--scales', nargs='+', choices=SCALES, default=['10k', '1m'])
+    parser.add_argument('--tolerance', type=float, default=0.25,
+                        help='allowed relative increase over the baseline')
+    parser.add_argument('--save-baseline', action='store_true',
+                        help='store these results as the new baseline of the measured scales')
+    parser.add_argument('--measure', metavar='OUTPUT', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        results = measure_stages()
+        with open(args.measure, 'w') as f:
+            json.dump(results, f, indent=2)
+        return
+
+    baseline = {}
+    if os.path.exists(BASELINE):
+        with open(BASELINE) as f:
+            baseline = json.load(f)
+
+    regressions = []
+    for scale in args.scales:
+        results = run_scale(scale)
+        regressions += compare(scale, results, baseline.get(scale, {}), args.tolerance)
+        if args.save_baseline:
+            baseline[scale] = results
+
+    if args.save_baseline:
+        with open(BASELINE, 'w') as f:
+            json.dump(baseline, f, indent=2)
+        print(f'\nSaved the baseline of {", ".join(args.scales)} to {BASELINE}.')
+    elif regressions:
+        print(f'\n{len(regressions)} stages regressed beyond {args.tolerance:.0%}:')
+        for scale, stage, flags in regressions:
+            print(f'  {scale} {stage}: {", ".join(flags)}')
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+"""Validates the contact stats read from sketches against the exact ones, and compares their cost.
+
+Run from the repository root:
+
+    python -m benchmarks.sketches
+"""
+import time
+import inspect
+import logging
+
+import numpy as np
+
+from modules.dataloader import load_data
+from modules.messages import words_to_ignore, list_contacts, get_contact_stats
+from modules.tokens import build_token_index
+from modules.sketches import build_contact_sketches, get_sketch, merge_sketches, estimate_distinct
+
+logging.basicConfig(level=logging.INFO)
+
+# bypass the memoization, every table has to be computed
+contact_stats = inspect.unwrap(get_contact_stats)
+
+
+def main():
+    df, _ = load_data()
+    token_index = build_token_index(df, words_to_ignore)
+
+    t0 = time.time()
+    sketches = build_contact_sketches(df, token_index)
+    logging.info(f'Building the sketches took {time.time()-t0:.4f} seconds.')
+
+    contacts = list_contacts(df)
+    t0 = time.time()
+    exact = contact_stats(df, contacts, token_index)
+    exact_seconds = time.time() - t0
+    t0 = time.time()
+    sketched = contact_stats(df, contacts, token_index, sketches)
+    sketched_seconds = time.time() - t0
+    logging.info(
+        f'Stats of all {len(contacts)} contacts: exact {exact_seconds:.4f} seconds, '
+        f'sketches {sketched_seconds:.4f} seconds.')
+
+    assert exact['Name'].tolist() == sketched['Name'].tolist()
+    for column in ['Message Count', 'Avg. words per msg']:
+        np.testing.assert_allclose(sketched[column], exact[column])
+    for column in ['Vocab. size', 'Avg. word length']:
+        error = np.abs(sketched[column] / exact[column] - 1)
+        logging.info(
+            f'{column}: relative error median {np.nanmedian(error):.2%}, max {np.nanmax(error):.2%}')
+
+    # merged sketches estimate the vocabulary of several contacts together
+    merged = get_sketch(sketches, contacts[0])
+    for contact in contacts[1:]:
+        merged = merge_sketches(merged, get_sketch(sketches, contact))
+    vocabulary = len(np.unique(token_index.ids[~token_index.ignored[token_index.ids]]))
+    logging.info(
+        f'Vocabulary of all contacts: {vocabulary}, estimated from the merged sketches: '
+        f'{estimate_distinct(merged.registers):.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,195 @@
+"""Writes a synthetic Messenger export: messages/inbox/<chat>/message_N.json, like the real download.
+
+Strings are stored mojibake-encoded (utf-8 bytes read as latin-1, then \\u escaped), the way Facebook
+exports them. Chat sizes and contact popularity are skewed, most chats are one-to-one.
+Run from the repository root, the output directory can be used as DATA_DIR:
+
+    python -m benchmarks.synthetic benchmarks/data/1m/data --messages 1000000 --chats 500
+"""
+import io
+import os
+import re
+import json
+import logging
+import argparse
+
+import numpy as np
+from PIL import Image
+
+# the name of the owner of the export, set MY_NAME to this when loading it
+SYNTHETIC_NAME = 'Mark Zuckerberg'
+# Messenger splits the messages of a chat over files of at most this many messages, newest first
+SHARD_SIZE = 10000
+
+FIRST_NAMES = ['Anna', 'Bram', 'Chloé', 'Daan', 'Élise', 'Femke', 'Gijs', 'Hélène', 'Iris', 'Joël',
+               'Kim', 'Lotte', 'Maël', 'Noah', 'Özge', 'Pieter', 'Quinten', 'Renée', 'Søren', 'Thijs',
+               'Uğur', 'Vera', 'Wout', 'Xavière', 'Yusuf', 'Zoë']
+LAST_NAMES = ['de Vries', 'Janssens', 'Müller', 'Peeters', 'Dubois', 'Nuñez', 'Van Damme', 'Öztürk',
+              'Lefèvre', 'Smith', 'Kowalski', 'Ødegaard', 'Claes', 'Maes', 'García', 'Wouters']
+WORDS = ['ik', 'je', 'het', 'de', 'een', 'en', 'is', 'dat', 'niet', 'wat', 'ok', 'haha', 'ja', 'nee',
+         'the', 'you', 'to', 'and', 'it', 'what', 'tomorrow', 'morgen', 'vandaag', 'café', 'naïve',
+         'déjà', 'vu', 'eten', 'film', 'trein', 'weekend', 'feestje', 'examen', 'koffie', 'bier',
+         'over', 'half', 'uur', 'zien', 'ben', 'thuis', 'onderweg', 'cool', 'lol', 'oké', 'ça', 'va',
+         '😂', '❤️', '👍', 'http', 'goed', 'slecht', 'waarom', 'wanneer', 'waar', 'hoe', 'wie']
+PUNCTUATION = ['', '', '', '.', '!', '?', '...']
+PHOTO_COLORS = [(200, 60, 60), (60, 200, 60), (60, 60, 200), (220, 200, 80)]
+
+# messages are spread over 2012 - 2020
+FIRST_TIMESTAMP_MS = 1325376000000
+LAST_TIMESTAMP_MS = 1577836800000
+
+
+def _mojibake(text):
+    return text.encode('utf-8').decode('latin-1')
+
+
+def _zipf_weights(n, exponent=1.0):
+    weights = 1 / np.arange(1, n + 1) ** exponent
+    return weights / weights.sum()
+
+
+def _contact_names(n):
+    names = [f'{first} {last}' for last in LAST_NAMES for first in FIRST_NAMES]
+    # numbered beyond all combinations, as with namesakes
+    return [names[i % len(names)] + (f' {i // len(names) + 1}' if i >= len(names) else '')
+            for i in range(n)]
+
+
+def _chat_title(participants):
+    """Messenger names one-to-one chats after the other participant, groups after the first few members"""
+
+    others = participants[1:]
+    if len(others) == 1:
+        return others[0]
+    if len(others) <= 3:
+        return ', '.join(others)
+    return ', '.join(name.split()[0] for name in others[:3]) + f' and {len(others) - 3} others'
+
+
+def _photo_bytes(color):
+    buffer = io.BytesIO()
+    Image.new('RGB', (64, 48), color).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+def _chat_messages(rng, chat_id, participants, n, photo_rate):
+    """n messages of one chat, newest first, and the relative uris of the photos they reference"""
+
+    # the owner sends about 40% of the messages, the others share the rest
+    others = len(participants) - 1
+    sender_weights = np.array([0.4] + [0.6 / others] * others)
+    senders = rng.choice(len(participants), size=n, p=sender_weights)
+    encoded = [_mojibake(name) for name in participants]
+
+    start, end = np.sort(rng.integers(FIRST_TIMESTAMP_MS, LAST_TIMESTAMP_MS, size=2))
+    timestamps = np.sort(rng.integers(start, end + 1, size=n))[::-1]
+
+    lengths = rng.geometric(0.15, size=n)
+    words = rng.choice(len(WORDS), size=lengths.sum(), p=_zipf_weights(len(WORDS)))
+    ends = np.cumsum(lengths)
+    punctuation = rng.choice(len(PUNCTUATION), size=n)
+    has_photo = rng.random(n) < photo_rate
+
+    messages = []
+    uris = []
+    for i in range(n):
+        message = {
+            'sender_name': encoded[senders[i]],
+            'timestamp_ms': int(timestamps[i]),
+        }
+        if has_photo[i]:
+            uri = f'messages/inbox/{chat_id}/photos/{len(uris)}_{timestamps[i]}.jpg'
+            uris.append(uri)
+            message['photos'] = [
+                {'uri': uri, 'creation_timestamp': int(timestamps[i] // 1000)}]
+        else:
+            text = ' '.join(WORDS[w] for w in words[ends[i] - lengths[i]:ends[i]])
+            message['content'] = _mojibake(text + PUNCTUATION[punctuation[i]])
+        message['type'] = 'Generic'
+        messages.append(message)
+
+    return messages, uris
+
+
+def generate(data_dir, messages=10000, chats=50, contacts=None, max_group_size=12,
+             group_rate=0.2, photo_rate=0.01, photo_files=True, seed=0):
+    """Writes the export to data_dir/messages/inbox"""
+
+    rng = np.random.default_rng(seed)
+    contacts = contacts or 2 * chats
+    names = _contact_names(contacts)
+    inbox = os.path.join(data_dir, 'messages', 'inbox')
+
+    # a few chats hold most of the messages, every chat has at least one
+    per_chat = rng.multinomial(messages - chats, _zipf_weights(chats, 0.8)) + 1
+    contact_weights = _zipf_weights(contacts, 0.7)
+
+    photo_blobs = [_photo_bytes(color) for color in PHOTO_COLORS]
+    written = 0
+    for c in range(chats):
+        # number of participants besides the owner
+        others = 1
+        if rng.random() < group_rate:
+            others = int(rng.integers(2, max(max_group_size, 3)))
+        members = rng.choice(contacts, size=min(others, contacts),
+                             replace=False, p=contact_weights)
+        participants = [SYNTHETIC_NAME] + [names[m] for m in members]
+        title = _chat_title(participants)
+
+        chat_id = re.sub('[^a-z0-9]', '', title.lower())[:20] + f'_{c:06d}'
+        chat_dir = os.path.join(inbox, chat_id)
+        os.makedirs(chat_dir, exist_ok=True)
+
+        chat_messages, uris = _chat_messages(
+            rng, chat_id, participants, int(per_chat[c]), photo_rate)
+
+        header = {
+            'participants': [{'name': _mojibake(name)} for name in participants],
+            'title': _mojibake(title),
+            'is_still_participant': True,
+            'thread_type': 'Regular' if others == 1 else 'RegularGroup',
+            'thread_path': f'inbox/{chat_id}',
+        }
+        for i, start in enumerate(range(0, len(chat_messages), SHARD_SIZE)):
+            shard = dict(header, messages=chat_messages[start:start + SHARD_SIZE])
+            with open(os.path.join(chat_dir, f'message_{i + 1}.json'), 'w') as jsonfile:
+                json.dump(shard, jsonfile, indent=2)
+
+        if photo_files and uris:
+            os.makedirs(os.path.join(chat_dir, 'photos'), exist_ok=True)
+            for i, uri in enumerate(uris):
+                with open(os.path.join(data_dir, uri), 'wb') as f:
+                    f.write(photo_blobs[i % len(photo_blobs)])
+
+        written += len(chat_messages)
+        if (c + 1) % 100 == 0:
+            logging.info(f'Wrote {c + 1}/{chats} chats, {written} messages.')
+
+    logging.info(
+        f'Wrote {written} messages in {chats} chats between {contacts} contacts to {inbox}.')
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('data_dir')
+    parser.add_argument('--messages', type=int, default=10000)
+    parser.add_argument('--chats', type=int, default=50)
+    parser.add_argument('--contacts', type=int, default=None,
+                        help='defaults to twice the number of chats')
+    parser.add_argument('--max-group-size', type=int, default=12)
+    parser.add_argument('--group-rate', type=float, default=0.2,
+                        help='fraction of the chats that are group chats')
+    parser.add_argument('--photo-rate', type=float, default=0.01,
+                        help='fraction of the messages that are a photo')
+    parser.add_argument('--no-photo-files', action='store_true',
+                        help='only reference photos, do not write the image files')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    generate(args.data_dir, args.messages, args.chats, args.contacts, args.max_group_size,
+             args.group_rate, args.photo_rate, not args.no_photo_files, args.seed)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,8 +1,50 @@
 import os
 
-DATA_DIR = 'data'
+# both can also be set in the environment, e.g. to run the benchmarks on a synthetic export
+DATA_DIR = os.environ.get('DATA_DIR', 'data')
 MSG_DIR = os.path.join(DATA_DIR, 'messages/inbox')
-MY_NAME = 'Mark Zuckerberg'
+MY_NAME = os.environ.get('MY_NAME', 'Mark Zuckerberg')
+
+# parsed messages are cached here, next to DATA_DIR
+CACHE_DIR = os.path.join(os.path.dirname(os.path.normpath(DATA_DIR)), 'cache')
+
+# serve the app right away and load the data in the background, tabs show progress until their data is ready
+LAZY_STARTUP = True
+
+# number of processes used to parse the raw json files, 1 disables the process pool
+LOAD_WORKERS = os.cpu_count() or 1
+# number of processes rendering photo previews in the background
+MEDIA_WORKERS = max(1, (os.cpu_count() or 1) // 2)
+# web server processes, set by gunicorn.conf.py. Every worker has its own memo and media caches,
+# their budgets below are totals split over the workers
+WEB_WORKERS = int(os.environ.get('WEB_CONCURRENCY', 1))
+# memory for recently viewed and prefetched photo previews
+MEDIA_CACHE_BYTES = 256 * 2**20 // WEB_WORKERS
+# number of photos before and after the current one that the Photo Viewer preloads
+PREFETCH_COUNT = 5
+
+# bounds of the cache shared by all memoized analyses and layouts
+MEMO_MAX_ENTRIES = 1024
+MEMO_MAX_BYTES = 512 * 2**20 // WEB_WORKERS
+
+# rows per page of the tables, only the visible page is computed and sent
+CONTACTS_PAGE_SIZE = 20
+TOP_WORDS_PAGE_SIZE = 10
+
+# points drawn per series of the message count graphs, about their width in pixels.
+# Zooming in redraws the visible part with up to as many points
+FIGURE_POINTS = 1000
+
+# callbacks send the numbers of their figures as typed binary buffers instead of JSON lists, see modules/transport.py
+BINARY_FIGURES = True
+
+# durations and payload sizes kept per timer for /debug/perf
+PERF_SAMPLES = 1000
+# calls slower than this are logged
+PERF_SLOW_SECONDS = 1.0
+# set PERF_PROFILE to cprofile or pyinstrument to profile every startup stage and callback request
+PERF_PROFILE = os.environ.get('PERF_PROFILE', '')
+PERF_PROFILE_DIR = os.path.join(CACHE_DIR, 'profiles')
 
 BORING_WORDS = {
     'jij', 'wel', 'nee', 'ok', 'heel', 'ga', 'oke', 'gaat', 'gaan',
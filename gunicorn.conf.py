@@ -0,0 +1,24 @@
+import gc
+import os
+
+bind = os.environ.get('BIND', '0.0.0.0:8050')
+workers = int(os.environ.get('WEB_CONCURRENCY', os.cpu_count() or 1))
+# config.py splits the cache budgets over the workers. This file is read before the app is loaded
+os.environ['WEB_CONCURRENCY'] = str(workers)
+timeout = 300
+
+# Load and preprocess all data once in the master process. Workers are forked afterwards and
+# share those pages copy-on-write, so adding workers does not duplicate the dataset.
+preload_app = True
+
+
+def when_ready(server):
+    # move everything loaded so far out of reach of the garbage collector: its passes would
+    # write to every object header and make each worker copy the shared pages
+    gc.freeze()
+    server.log.info(f'Froze {gc.get_freeze_count()} objects before forking workers.')
+
+
+def post_fork(server, worker):
+    from modules.media import detach_media_workers
+    detach_media_workers()
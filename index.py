@@ -1,6 +1,3 @@
-import time
-import logging
-
 import dash_core_components as dcc
 import dash_html_components as html
 from dash.dependencies import Input, Output
@@ -16,26 +13,56 @@ from apps.messages import callbacks as msg_callbacks
 from modules.dataloader import load_data
 from modules.messages import *
 from modules.network import build_graph
+from modules.tokens import build_token_index
+from modules.sketches import build_contact_sketches
+from modules.topwords import build_top_words
+from modules.media import start_media_workers, register_media_route, build_photo_index
+from modules.memo import register_memo_route
+from modules.perf import register_perf_route
+from modules.store import define_artifact, start_loading, wait_for_all, get_artifact, is_ready, loading_status
+
+from config import MY_NAME, LAZY_STARTUP
+
+
+def load_messages():
+    df, df_photos = load_data()
+
+    assert MY_NAME in df.sender_name.unique().tolist(),\
+        f"Name \"{MY_NAME}\" (in config.py) is not a valid sender_name, is your name \"{df.sender_name.mode().values[0]}\"?"
+
+    # Thumbnails and previews are rendered in the background while the rest loads
+    start_media_workers(df_photos.photo_uri.unique().tolist())
+    return df, df_photos
+
 
-from config import MY_NAME
+def build_network(df):
+    names, adjacency = get_sparse_adjacency_matrix(df)
+    return build_graph(adjacency, names)
 
-# Dataload Messages
-t0 = time.time()
-df, df_photos = load_data()
-logging.info(f'Loading all data took {time.time()-t0:.4f} seconds.')
 
-assert MY_NAME in df.sender_name.unique().tolist(),\
-    f"Name \"{MY_NAME}\" (in config.py) is not a valid sender_name, is your name \"{df.sender_name.mode().values[0]}\"?"
+# Dataload and preprocessing Messages, cheapest first so the first tabs get ready early
+define_artifact(('df', 'df_photos'), load_messages)
+define_artifact('chat_index', build_chat_index, ['df'])
+define_artifact('msg_counts', get_hourly_msg_counts, ['df'])
+define_artifact('msg_counts_index', build_chat_index, ['msg_counts'])
+define_artifact('photo_index', build_photo_index, ['df_photos'])
+define_artifact('token_index', lambda df: build_token_index(
+    df, words_to_ignore), ['df'])
+define_artifact('contact_sketches', build_contact_sketches, ['df', 'token_index'])
+define_artifact('top_words', build_top_words, ['df', 'token_index'])
+# the layout of the network graph is the most expensive step, only built when its tab is opened
+define_artifact('G', build_network, ['df'], lazy=True)
 
-# Preprocessing Messages
-t0 = time.time()
-names, adjacency = get_weighted_adjacency_matrix(df)
-G = build_graph(adjacency, names)
-logging.info(f'Preprocessing took {time.time()-t0:.4f} seconds.')
+if LAZY_STARTUP:
+    start_loading()
+else:
+    wait_for_all()
 
 # Page Layout
 app.layout = html.Div([
     dcc.Location(id='url', refresh=False),
+    # polls while a page waits for its data
+    dcc.Interval(id='page-interval', interval=1000, disabled=True),
     html.Div(children=[
         html.Div(children=[
             dcc.Link('Home', href='/'),
@@ -61,23 +88,30 @@ app.layout = html.Div([
     html.Div(id='page-content')
 ])
 
-# Register callbacks for separate apps
+# Register callbacks and routes for separate apps
+register_media_route(app.server)
+register_memo_route(app.server)
+register_perf_route(app.server)
 example_callbacks.register_callbacks(app)
-msg_callbacks.register_callbacks(
-    app, df, df_photos, G)
+msg_callbacks.register_callbacks(app)
 
 # Callbacks that render the page content based on the current path
-@app.callback(Output('page-content', 'children'),
-              [Input('url', 'pathname')])
-def display_page(pathname):
+@app.callback([Output('page-content', 'children'),
+               Output('page-interval', 'disabled')],
+              [Input('url', 'pathname'),
+               Input('page-interval', 'n_intervals')])
+def display_page(pathname, n_intervals):
     if pathname == '/':
-        return html.Div(html.H1('This is the homepage. Nothing to see here.'))
+        return html.Div(html.H1('This is the homepage. Nothing to see here.')), True
     elif pathname == '/messages':
-        return msg_layout.get_layout(df)
+        if not is_ready('df'):
+            status = loading_status('df')
+            return msg_layout.get_progress(status), status[0]['state'] == 'failed'
+        return msg_layout.get_layout(get_artifact('df')), True
     elif pathname == '/example':
-        return example_layout.get_layout()
+        return example_layout.get_layout(), True
     else:
-        return html.Div(html.H1('404'))
+        return html.Div(html.H1('404')), True
 
 
 if __name__ == '__main__':
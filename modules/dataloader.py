@@ -1,12 +1,46 @@
 import os
+import sys
 import copy
 import json
 import pandas as pd
 import logging
 import datetime
-import base64
+import re
+import hashlib
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+import pyarrow as pa
+import pyarrow.feather as feather
 
 from config import *
+from modules.memo import bump_data_version
+from modules.perf import timed
+
+TEXT_COLUMNS = ['chat_id', 'title', 'timestamp', 'sender_name', 'content']
+PHOTO_COLUMNS = ['chat_id', 'title', 'timestamp',
+                 'sender_name', 'photo_uri', 'photo_creation_timestamp']
+
+# of the cached message files, fixed so that empty ones concatenate too
+TEXT_SCHEMA = pa.schema([('chat_id', pa.string()), ('title', pa.string()), ('timestamp', pa.int64()),
+                         ('sender_name', pa.string()), ('content', pa.string())])
+PHOTO_SCHEMA = pa.schema([('chat_id', pa.string()), ('title', pa.string()), ('timestamp', pa.int64()),
+                          ('sender_name', pa.string()), ('photo_uri', pa.string()),
+                          ('photo_creation_timestamp', pa.int64())])
+
+# few distinct values repeated on millions of rows, these are stored dictionary-encoded
+CATEGORICAL_COLUMNS = ['chat_id', 'title', 'sender_name']
+
+SHARD_PATTERN = re.compile(r'^message_(\d+)\.json$')
+
+# bump whenever the layout of df or df_photos changes, to invalidate existing caches
+CACHE_VERSION = 3
+CACHE_MANIFEST = os.path.join(CACHE_DIR, 'manifest.json')
+CACHE_MESSAGES = os.path.join(CACHE_DIR, 'messages.feather')
+CACHE_PHOTOS = os.path.join(CACHE_DIR, 'photos.feather')
+# parsed columns of every message file, named after its path, size and mtime
+CACHE_SHARDS = os.path.join(CACHE_DIR, 'shards')
 
 # helper functions
 
@@ -17,58 +51,239 @@ def _load_messages(filename):
         return data
 
 
-def _get_path_to_chat_json(chat_id):
-    return os.path.join(MSG_DIR, chat_id, 'message_1.json')
+def _get_paths_to_chat_json(chat_id):
+    """Returns all message_N.json shards of a chat, ordered by N"""
+
+    chat_dir = os.path.join(MSG_DIR, chat_id)
+    shards = []
+    for filename in os.listdir(chat_dir):
+        match = SHARD_PATTERN.match(filename)
+        if match:
+            shards.append((int(match.group(1)), filename))
+    return [os.path.join(chat_dir, filename) for _, filename in sorted(shards)]
 
 
 def _list_chat_ids():
     return [filename for filename in sorted(os.listdir(MSG_DIR)) if not filename == '.DS_Store']
 
 
+def _list_shards():
+    return [(chat_id, filename) for chat_id in _list_chat_ids() for filename in _get_paths_to_chat_json(chat_id)]
+
+
+def _file_signature(filename):
+    stat = os.stat(filename)
+    return stat.st_size, stat.st_mtime_ns
+
+
+def _fix_encoding(strings):
+    """Repairs Facebook's mojibake (utf-8 bytes exported as latin-1 code points) of many strings at once"""
+
+    # NUL never appears inside an utf-8 multi-byte sequence, so it separates the strings safely
+    joined = '\x00'.join(strings)
+    if joined.count('\x00') == max(len(strings) - 1, 0):
+        try:
+            return joined.encode('latin1').decode('utf8').split('\x00') if strings else []
+        except UnicodeError:
+            pass
+    # strings holding NUL themselves, or an invalid one: per string, raising on the culprit
+    return [string.encode('latin1').decode('utf8') for string in strings]
+
+
+def _decode_buffers(title, text, photos):
+    """Decoding stage: every distinct name is decoded (and interned) once, all content in one batch"""
+
+    names = set(text['sender_name']).union(photos['sender_name'])
+    names = dict(zip(names, map(sys.intern, _fix_encoding(list(names)))))
+    for buffers in (text, photos):
+        buffers['sender_name'] = [names[name]
+                                  for name in buffers['sender_name']]
+    text['content'] = _fix_encoding(text['content'])
+    return sys.intern(_fix_encoding([title])[0])
+
+
+def _parse_shard(shard):
+    """Parses a single message_N.json file into column buffers of text and photo messages"""
+
+    chat_id, filename = shard
+    data = _load_messages(filename)
+
+    # one pass per column: comprehensions are much cheaper than appending field by field
+    messages = [msg for msg in data['messages'] if 'content' in msg]
+    text = {
+        'timestamp': [msg['timestamp_ms'] for msg in messages],
+        'sender_name': [msg['sender_name'] for msg in messages],
+        'content': [msg['content'] for msg in messages],
+    }
+
+    items = [(msg, item) for msg in data['messages']
+             if 'photos' in msg for item in msg['photos']]
+    photos = {
+        'timestamp': [msg['timestamp_ms'] for msg, _ in items],
+        'sender_name': [msg['sender_name'] for msg, _ in items],
+        'photo_uri': [os.path.join(DATA_DIR, item['uri']) for _, item in items],
+        'photo_creation_timestamp': [item['creation_timestamp'] for _, item in items],
+    }
+
+    title = _decode_buffers(data['title'], text, photos)
+
+    # constant per chat, so only fill them in once the length is known
+    for buffers in (text, photos):
+        n = len(buffers['timestamp'])
+        buffers['chat_id'] = [chat_id] * n
+        buffers['title'] = [title] * n
+
+    return text, photos
+
+
+def _get_shard_paths(filename, signature):
+    """Paths of the cached text and photo columns of a message file"""
+
+    key = hashlib.sha1(json.dumps(
+        [CACHE_VERSION, filename, list(signature)]).encode('utf8')).hexdigest()
+    return tuple(os.path.join(CACHE_SHARDS, f'{key}.{kind}.feather') for kind in ('text', 'photos'))
+
+
+def _store_shard(job):
+    """Parses a message file and writes its columns to the shard cache"""
+
+    shard, paths = job
+    for buffers, schema, path in zip(_parse_shard(shard), (TEXT_SCHEMA, PHOTO_SCHEMA), paths):
+        feather.write_feather(pa.Table.from_pydict(buffers, schema), path + '.tmp',
+                              compression='uncompressed')
+        os.replace(path + '.tmp', path)
+
+
+def _store_shards(jobs):
+    if LOAD_WORKERS <= 1 or len(jobs) <= 1:
+        for job in jobs:
+            _store_shard(job)
+        return
+
+    chunksize = max(1, len(jobs) // (4 * LOAD_WORKERS))
+    with ProcessPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        list(executor.map(_store_shard, jobs, chunksize=chunksize))
+
+
+def _refresh_shard_cache(shards, signatures):
+    """Parses only the message files that were added or changed since they were cached, returns the cache paths of every shard"""
+
+    os.makedirs(CACHE_SHARDS, exist_ok=True)
+    paths = [_get_shard_paths(filename, signatures[filename])
+             for _, filename in shards]
+    stale = [(shard, shard_paths) for shard, shard_paths in zip(shards, paths)
+             if not all(map(os.path.exists, shard_paths))]
+    _store_shards(stale)
+
+    # removed or modified message files
+    current = {os.path.basename(path) for shard_paths in paths for path in shard_paths}
+    for name in set(os.listdir(CACHE_SHARDS)).difference(current):
+        os.remove(os.path.join(CACHE_SHARDS, name))
+
+    logging.info(
+        f'Parsed {len(stale)} new or modified of {len(shards)} message files.')
+    return paths
+
+
+def _read_shards(paths, schema):
+    # one conversion to pandas for all files, it is much slower than concatenating in arrow
+    tables = [feather.read_table(path) for path in paths]
+    return pa.concat_tables(tables or [schema.empty_table()]).to_pandas()
+
+
+def _to_datetime_ms(values):
+    return pd.to_datetime(np.asarray(values, dtype=np.int64), unit='ms')
+
+
+def _bytes_per_row(df):
+    return df.memory_usage(index=False, deep=True).sum() / max(len(df), 1)
+
+
+def _compact_schema(df, name):
+    """Dictionary-encodes the repeated string columns, logging the memory gained"""
+
+    before = _bytes_per_row(df)
+    for col in CATEGORICAL_COLUMNS:
+        df[col] = df[col].astype('category')
+    after = _bytes_per_row(df)
+
+    logging.info(
+        f'{name}: {len(df)} rows, {before:.1f} bytes/row before and {after:.1f} bytes/row after compacting.')
+    return df
+
+
+# columnar cache
+
+def _build_manifest(signatures):
+    return {
+        'version': CACHE_VERSION,
+        'files': {filename: list(signature) for filename, signature in signatures.items()}
+    }
+
+
+def _read_cache(manifest):
+    """Returns the cached (df, df_photos) if they were built from exactly these source files, else None"""
+
+    try:
+        with open(CACHE_MANIFEST) as jsonfile:
+            if json.load(jsonfile) != manifest:
+                logging.info('Cache manifest is outdated, rebuilding the cache.')
+                return None
+        df = feather.read_table(CACHE_MESSAGES, memory_map=True).to_pandas()
+        df_photos = feather.read_table(
+            CACHE_PHOTOS, memory_map=True).to_pandas()
+    except (OSError, ValueError) as e:
+        logging.info(f'No usable cache in {CACHE_DIR}: {e}')
+        return None
+
+    return df, df_photos
+
+
+def _write_cache(df, df_photos, manifest):
+    os.makedirs(CACHE_DIR, exist_ok=True)
+
+    # the manifest goes last, a crash halfway leaves an invalid cache rather than a wrong one
+    if os.path.exists(CACHE_MANIFEST):
+        os.remove(CACHE_MANIFEST)
+    for frame, filename in ((df, CACHE_MESSAGES), (df_photos, CACHE_PHOTOS)):
+        feather.write_feather(frame, filename + '.tmp',
+                              compression='uncompressed')
+        os.replace(filename + '.tmp', filename)
+    with open(CACHE_MANIFEST, 'w') as jsonfile:
+        json.dump(manifest, jsonfile)
+
+
 # dataload
 
+@timed
 def load_data():
-    text_msgs = []
-    photo_msgs = []
-
-    for chat_id in _list_chat_ids():
-        filename = _get_path_to_chat_json(chat_id)
-        data = _load_messages(filename)
-        title = data['title'].encode('latin1').decode('utf8')
-        for msg in data['messages']:
-            if 'content' in msg.keys():
-                text_msgs.append(
-                    {
-                        'chat_id': chat_id,
-                        'title': title,
-                        'timestamp': msg['timestamp_ms'],
-                        'sender_name': msg['sender_name'].encode('latin1').decode('utf8'),
-                        'content': msg['content'].encode('latin1').decode('utf8'),
-                    }
-                )
-            if 'photos' in msg.keys():
-                for item in msg.get('photos'):
-                    photo_msgs.append(
-                        {
-                            'chat_id': chat_id,
-                            'title': title,
-                            'timestamp': msg['timestamp_ms'],
-                            'sender_name': msg['sender_name'].encode('latin1').decode('utf8'),
-                            'photo_uri': os.path.join(DATA_DIR, item['uri']),
-                            'photo_creation_timestamp': item['creation_timestamp']
-                        }
-                    )
-
-    df = pd.DataFrame(text_msgs)
-    df['timestamp'] = pd.to_datetime(df['timestamp'], unit='ms')
-
-    df_photos = pd.DataFrame(photo_msgs)
-    df_photos['timestamp'] = pd.to_datetime(df_photos['timestamp'], unit='ms')
-    df_photos['photo_creation_timestamp'] = pd.to_datetime(
-        df_photos['photo_creation_timestamp'], unit='ms')
+    shards = _list_shards()
+    signatures = {filename: _file_signature(filename)
+                  for _, filename in shards}
+    manifest = _build_manifest(signatures)
 
-    return df, df_photos
+    cached = _read_cache(manifest)
+    if cached is not None:
+        logging.info(f'Loaded messages from the cache in {CACHE_DIR}.')
+        bump_data_version()
+        return cached
 
+    paths = _refresh_shard_cache(shards, signatures)
 
-def read_image(filename):
-    return base64.b64encode(open(filename, 'rb').read())
+    df = _read_shards([text for text, _ in paths], TEXT_SCHEMA)
+    df['timestamp'] = _to_datetime_ms(df['timestamp'])
+    df = _compact_schema(df, 'Messages')
+    # stored grouped per chat and per sender, so a chat is a slice (see build_chat_index)
+    df = df.sort_values(['title', 'sender_name', 'timestamp'],
+                        kind='mergesort', ignore_index=True)
+
+    df_photos = _read_shards([photos for _, photos in paths], PHOTO_SCHEMA)
+    df_photos['timestamp'] = _to_datetime_ms(df_photos['timestamp'])
+    df_photos['photo_creation_timestamp'] = _to_datetime_ms(
+        df_photos['photo_creation_timestamp'])
+    df_photos = _compact_schema(df_photos, 'Photos')
+
+    _write_cache(df, df_photos, manifest)
+    bump_data_version()
+
+    return df, df_photos
@@ -0,0 +1,87 @@
+import numpy as np
+import pandas as pd
+
+from modules.perf import timed
+
+
+def lttb(x, y, n_out):
+    """Positions of the n_out points of the series (x, y) kept by Largest-Triangle-Three-Buckets.
+    The first and last points are always kept, every bucket in between keeps the point making the
+    largest triangle with the point kept before it and the average of the next bucket"""
+
+    n = len(x)
+    if n <= n_out or n_out < 3:
+        return np.arange(n)
+
+    x = x.astype(np.float64)
+    y = y.astype(np.float64)
+    edges = np.linspace(1, n - 1, n_out - 1).astype(np.int64)
+    edges = np.append(edges, n)
+
+    kept = np.empty(n_out, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    a = 0
+    for i in range(n_out - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_x = x[hi:edges[i + 2]].mean()
+        next_y = y[hi:edges[i + 2]].mean()
+        area = np.abs((x[a] - next_x) * (y[lo:hi] - y[a]) -
+                      (x[a] - x[lo:hi]) * (next_y - y[a]))
+        a = lo + int(np.argmax(area))
+        kept[i + 1] = a
+    return kept
+
+
+def min_max(y, n_out):
+    """Positions of the smallest and largest value of every one of n_out / 2 equal buckets of the series y"""
+
+    n = len(y)
+    if n <= n_out or n_out < 2:
+        return np.arange(n)
+
+    buckets = np.arange(n) * (n_out // 2) // n
+    order = np.lexsort((y, buckets))
+    last = np.ones(n, dtype=bool)
+    last[:-1] = buckets[order][1:] != buckets[order][:-1]
+    first = np.ones(n, dtype=bool)
+    first[1:] = last[:-1]
+    return np.unique(order[first | last])
+
+
+def visible_range(relayout_data):
+    """The (start, end) of the x axis a graph was zoomed to, None if it shows everything.
+    Raises KeyError if relayout_data does not concern the x axis"""
+
+    if not relayout_data or relayout_data.get('xaxis.autorange'):
+        return None
+    if 'xaxis.range[0]' in relayout_data:
+        return pd.Timestamp(relayout_data['xaxis.range[0]']), pd.Timestamp(relayout_data['xaxis.range[1]'])
+    if 'xaxis.range' in relayout_data:
+        start, end = relayout_data['xaxis.range']
+        return pd.Timestamp(start), pd.Timestamp(end)
+    raise KeyError('xaxis.range')
+
+
+@timed
+def downsample(df, x, y, by, n_points, method='lttb', window=None):
+    """Rows of df to draw every series (the rows of a by group, ordered by x) with at most about n_points points.
+    With a window (start, end), only the points within it and their neighbours are drawn, at full detail if they fit"""
+
+    positions = []
+    for rows in df.groupby(by, sort=False).indices.values():
+        xs = df[x].values[rows]
+        if window is not None:
+            # one point past either end, so lines reach the edges of the graph
+            lo = max(np.searchsorted(xs, np.datetime64(window[0]), side='left') - 1, 0)
+            hi = np.searchsorted(xs, np.datetime64(window[1]), side='right') + 1
+            rows, xs = rows[lo:hi], xs[lo:hi]
+        ys = df[y].values[rows]
+        if method == 'lttb':
+            kept = lttb(xs.astype(np.int64), ys, n_points)
+        else:
+            kept = min_max(ys, n_points)
+        positions.append(rows[kept])
+
+    if not positions:
+        return df
+    return df.iloc[np.sort(np.concatenate(positions))]
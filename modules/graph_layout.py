@@ -0,0 +1,152 @@
+import os
+import time
+import hashlib
+import logging
+
+import numpy as np
+from scipy import sparse
+
+from config import CACHE_DIR
+
+LAYOUT_SEED = 42
+LAYOUT_ITERATIONS = 100
+# nodes in the same or an adjacent grid cell repel each other exactly, further cells repel as one mass at
+# their center. About sqrt(3) * n ** (1/4) cells per side balances both parts (9 n² / cells pairs of
+# neighbours against n * cells centers), so the repulsion grows as n ** 1.5
+MAX_GRID_SIZE = 64
+BLOCK_SIZE = 1024
+# the cell of a node and its 8 neighbours
+NEIGHBOURS = np.array([(dx, dy) for dx in (-1, 0, 1) for dy in (-1, 0, 1)])
+
+
+def _near_repulsion(pos, k, cell_xy, cells, grid_size):
+    """Exact repulsive displacement between every pair of nodes in the same or adjacent grid cells"""
+
+    n = len(pos)
+    order = np.argsort(cells, kind='stable')
+    starts = np.searchsorted(cells[order], np.arange(grid_size ** 2))
+    counts = np.searchsorted(cells[order], np.arange(grid_size ** 2), side='right') - starts
+
+    displacement = np.zeros_like(pos)
+    for start in range(0, n, BLOCK_SIZE):
+        nodes = np.arange(start, min(start + BLOCK_SIZE, n))
+        xy = cell_xy[nodes][:, None, :] + NEIGHBOURS
+        valid = ((xy >= 0) & (xy < grid_size)).all(axis=2)
+        neighbours = xy[valid][:, 0] * grid_size + xy[valid][:, 1]
+
+        # every node paired with all nodes of its neighbouring cells, but not with itself
+        sizes = counts[neighbours]
+        rows = np.repeat(np.broadcast_to(nodes[:, None], valid.shape)[valid], sizes)
+        first = np.repeat(starts[neighbours] - np.cumsum(sizes) + sizes, sizes)
+        cols = order[first + np.arange(len(rows))]
+        rows, cols = rows[rows != cols], cols[rows != cols]
+
+        delta = pos[rows] - pos[cols]
+        distance = np.maximum(np.sqrt((delta ** 2).sum(axis=1)), 1e-3)
+        force = k ** 2 / distance ** 2
+        for dim in range(2):
+            displacement[:, dim] += np.bincount(rows, weights=delta[:, dim] * force, minlength=n)
+    return displacement
+
+
+def _repulsion(pos, k, grid_size):
+    """Barnes-Hut style repulsive displacement, using one level of grid cells instead of a quadtree"""
+
+    n = len(pos)
+    lower = pos.min(axis=0)
+    extent = np.maximum(pos.max(axis=0) - lower, 1e-9)
+    cell_xy = np.minimum(((pos - lower) / extent * grid_size).astype(np.int64), grid_size - 1)
+    cells = cell_xy[:, 0] * grid_size + cell_xy[:, 1]
+
+    displacement = _near_repulsion(pos, k, cell_xy, cells, grid_size)
+
+    mass = np.bincount(cells, minlength=grid_size ** 2).astype(np.float64)
+    occupied = np.flatnonzero(mass)
+    mass = mass[occupied]
+    centroids = np.stack([
+        np.bincount(cells, weights=pos[:, dim], minlength=grid_size ** 2)[occupied] / mass
+        for dim in range(2)], axis=1)
+    occupied_xy = np.stack([occupied // grid_size, occupied % grid_size], axis=1)
+
+    for start in range(0, n, BLOCK_SIZE):
+        block = slice(start, min(start + BLOCK_SIZE, n))
+        delta = pos[block][:, None, :] - centroids
+        distance = np.maximum(np.sqrt((delta ** 2).sum(axis=2)), 1e-3)
+        # the neighbouring cells were counted exactly
+        far = (np.abs(cell_xy[block][:, None, :] - occupied_xy) > 1).any(axis=2)
+        force = np.where(far, mass * k ** 2 / distance ** 2, 0)
+        displacement[block] += (delta * force[:, :, None]).sum(axis=1)
+
+    return displacement
+
+
+def _attraction(pos, rows, cols, weights, k):
+    delta = pos[rows] - pos[cols]
+    distance = np.sqrt((delta ** 2).sum(axis=1))
+    force = weights * distance / k
+    displacement = np.zeros_like(pos)
+    for dim in range(2):
+        displacement[:, dim] = -np.bincount(rows, weights=delta[:, dim] * force, minlength=len(pos))
+    return displacement
+
+
+def force_layout(connectivity, seed=LAYOUT_SEED, iterations=LAYOUT_ITERATIONS):
+    """Fruchterman-Reingold layout of a sparse weighted graph, returns an (n, 2) array of positions in [-1, 1]"""
+
+    n = connectivity.shape[0]
+    if n <= 1:
+        return np.zeros((n, 2))
+
+    # symmetric, log-scaled edge weights so a few chatty contacts do not collapse the layout
+    coo = sparse.coo_matrix(connectivity + connectivity.T)
+    weights = np.log1p(coo.data.astype(np.float64))
+    weights /= weights.max()
+
+    random = np.random.RandomState(seed)
+    pos = random.random_sample((n, 2))
+    k = 1 / np.sqrt(n)
+    grid_size = int(np.clip(np.sqrt(3) * n ** 0.25, 1, MAX_GRID_SIZE))
+
+    temperature = 0.1
+    cooling = temperature / (iterations + 1)
+    for _ in range(iterations):
+        displacement = _repulsion(pos, k, grid_size) + \
+            _attraction(pos, coo.row, coo.col, weights, k)
+        length = np.maximum(np.sqrt((displacement ** 2).sum(axis=1)), 1e-9)
+        pos += displacement * (np.minimum(length, temperature) / length)[:, None]
+        temperature -= cooling
+
+    pos -= pos.mean(axis=0)
+    return pos / np.abs(pos).max()
+
+
+def _layout_key(connectivity, names, seed, iterations):
+    connectivity = sparse.csr_matrix(connectivity)
+    connectivity.sort_indices()
+
+    digest = hashlib.sha1()
+    digest.update('\n'.join(names).encode('utf8'))
+    for array in (connectivity.indptr, connectivity.indices, connectivity.data):
+        digest.update(np.ascontiguousarray(array).tobytes())
+    digest.update(f'{seed}-{iterations}'.encode('utf8'))
+    return digest.hexdigest()
+
+
+def get_layout(connectivity, names, seed=LAYOUT_SEED, iterations=LAYOUT_ITERATIONS):
+    """Positions for every node, reused from CACHE_DIR as long as the graph does not change"""
+
+    filename = os.path.join(
+        CACHE_DIR, f'layout-{_layout_key(connectivity, names, seed, iterations)}.npy')
+
+    if os.path.exists(filename):
+        logging.info(f'Reusing the cached graph layout {filename}.')
+        return np.load(filename)
+
+    t0 = time.time()
+    pos = force_layout(connectivity, seed, iterations)
+    logging.info(
+        f'Layout of {len(names)} nodes took {time.time()-t0:.4f} seconds.')
+
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    np.save(filename, pos)
+    return pos
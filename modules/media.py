@@ -0,0 +1,254 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from flask import Response, abort, request, send_file
+from PIL import Image, ImageOps
+
+from config import CACHE_DIR, MEDIA_WORKERS, MEDIA_CACHE_BYTES
+from modules.perf import timed
+from modules.store import get_artifact, is_ready
+
+# derived images are stored content-addressed: MEDIA_DIR/<variant>/<sha1 of the original>.jpg
+MEDIA_DIR = os.path.join(CACHE_DIR, 'media')
+VARIANTS = {
+    'preview': 1280,
+}
+MEDIA_MAX_AGE = 7 * 24 * 3600
+
+# photo_uri -> sha1 of its content, for every original rendered so far
+_digests = {}
+_executor = None
+
+# recently served or prefetched derived images: (photo_uri, variant) -> (etag, bytes)
+_byte_cache = OrderedDict()
+_byte_cache_stats = {'bytes': 0, 'hits': 0, 'misses': 0}
+_byte_cache_lock = threading.Lock()
+_prefetcher = ThreadPoolExecutor(max_workers=2)
+
+
+def _file_digest(filename):
+    digest = hashlib.sha1()
+    with open(filename, 'rb') as f:
+        for block in iter(lambda: f.read(2**20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_digest(filename):
+    """sha1 of the content of an original photo"""
+
+    digest = _digests.get(filename)
+    if digest is None:
+        digest = _digests[filename] = _file_digest(filename)
+    return digest
+
+
+def _get_derived_path(digest, variant):
+    return os.path.join(MEDIA_DIR, variant, f'{digest}.jpg')
+
+
+def _render(filename):
+    """Writes every missing variant of an original, returns the digest of the original"""
+
+    digest = _file_digest(filename)
+    missing = [variant for variant in VARIANTS
+               if not os.path.exists(_get_derived_path(digest, variant))]
+    if not missing:
+        return digest
+
+    with Image.open(filename) as original:
+        image = ImageOps.exif_transpose(original).convert('RGB')
+
+    for variant in missing:
+        path = _get_derived_path(digest, variant)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        resized = image.copy()
+        resized.thumbnail((VARIANTS[variant], VARIANTS[variant]))
+        # write next to the target first, so a half written file is never served
+        resized.save(path + '.tmp', format='JPEG', quality=85)
+        os.replace(path + '.tmp', path)
+
+    return digest
+
+
+def _on_rendered(filename, future):
+    if future.exception() is not None:
+        logging.warning(
+            f'Could not render {filename}: {future.exception()}')
+    else:
+        _digests[filename] = future.result()
+
+
+def start_media_workers(filenames):
+    """Renders previews of all photos in a background process pool, returns immediately"""
+
+    global _executor
+    _executor = ProcessPoolExecutor(max_workers=MEDIA_WORKERS)
+    for filename in filenames:
+        if filename not in _digests:
+            future = _executor.submit(_render, filename)
+            future.add_done_callback(
+                lambda future, filename=filename: _on_rendered(filename, future))
+    logging.info(
+        f'Rendering {len(filenames)} photos with {MEDIA_WORKERS} processes in the background.')
+
+
+def detach_media_workers():
+    """Call in a process forked after start_media_workers: the render processes belong to the parent"""
+
+    global _executor
+    if _executor is not None:
+        # otherwise multiprocessing tries to join the parent's processes when this one exits
+        multiprocessing.process._children.difference_update(
+            _executor._processes.values())
+        _executor = None
+
+
+def get_media(filename, variant):
+    """Returns the path of a variant of an original photo, and its ETag, rendering it now if needed"""
+
+    if variant == 'original':
+        return filename, get_digest(filename)
+
+    digest = _digests.get(filename)
+    if digest is None or not os.path.exists(_get_derived_path(digest, variant)):
+        digest = _render(filename)
+        _digests[filename] = digest
+    return _get_derived_path(digest, variant), f'{digest}-{variant}'
+
+
+def _read_derived(filename, variant):
+    path, etag = get_media(filename, variant)
+    with open(path, 'rb') as f:
+        return etag, f.read()
+
+
+def _insert(key, entry, recent):
+    """Adds an entry to the byte cache and evicts the least recently used ones beyond MEDIA_CACHE_BYTES"""
+
+    with _byte_cache_lock:
+        if key not in _byte_cache:
+            _byte_cache[key] = entry
+            _byte_cache_stats['bytes'] += len(entry[1])
+            # prefetched images go to the least recently used end, they must not evict what is being viewed
+            _byte_cache.move_to_end(key, last=recent)
+        while _byte_cache_stats['bytes'] > MEDIA_CACHE_BYTES and len(_byte_cache) > 1:
+            _, (_, evicted) = _byte_cache.popitem(last=False)
+            _byte_cache_stats['bytes'] -= len(evicted)
+
+
+def get_media_bytes(filename, variant):
+    """Returns the (ETag, content) of a derived image, and whether it came from the byte cache"""
+
+    key = (filename, variant)
+    with _byte_cache_lock:
+        if key in _byte_cache:
+            _byte_cache.move_to_end(key)
+            _byte_cache_stats['hits'] += 1
+            return _byte_cache[key], True
+        _byte_cache_stats['misses'] += 1
+
+    entry = _read_derived(filename, variant)
+    _insert(key, entry, recent=True)
+    return entry, False
+
+
+def _warm(filename, variant):
+    if (filename, variant) in _byte_cache:
+        return
+    try:
+        entry = _read_derived(filename, variant)
+    except (OSError, ValueError) as e:
+        logging.warning(f'Could not prefetch {filename}: {e}')
+        return
+    _insert((filename, variant), entry, recent=False)
+
+
+def prefetch_media(filenames, variant='preview'):
+    """Reads derived images into the byte cache in the background, returns immediately"""
+
+    for filename in filenames:
+        _prefetcher.submit(_warm, filename, variant)
+
+
+@timed
+def build_photo_index(df_photos):
+    """Per chat title: its photos sorted by timestamp (ids, senders, dates) and the position of the first photo of every day"""
+
+    photo_index = {}
+    ordered = df_photos.sort_values('timestamp', kind='mergesort')
+    for title, group in ordered.groupby(ordered['title'].astype(object), sort=False):
+        days = group.timestamp.dt.normalize().values
+        _, first_of_day = np.unique(days, return_index=True)
+        labels = group.timestamp.dt.strftime('%d/%m/%Y').values
+
+        photo_index[title] = {
+            'ids': group.index.values,
+            'uris': group.photo_uri.values,
+            'senders': group.sender_name.astype(object).values,
+            'dates': group.timestamp.dt.strftime('%d-%m-%Y %H:%M').values,
+            'marks': {int(i): labels[i] for i in first_of_day},
+        }
+
+    return photo_index
+
+
+def get_media_url(photo_id, filename, variant='preview'):
+    """Content-addressed URL of a photo: the digest changes with the content, the id only tells where to find it"""
+
+    return f'/media/{variant}/{get_digest(filename)}/{photo_id}'
+
+
+def register_media_route(server):
+    """Serves the photos in the df_photos artifact by digest, with ETag and Cache-Control headers"""
+
+    @server.route('/media/<variant>/<digest>/<int:photo_id>')
+    def serve_media(variant, digest, photo_id):
+        if variant != 'original' and variant not in VARIANTS:
+            abort(404)
+        if not is_ready('df_photos'):
+            abort(503)
+        df_photos = get_artifact('df_photos')
+        if photo_id not in df_photos.index:
+            abort(404)
+
+        t0 = time.time()
+        filename = df_photos.at[photo_id, 'photo_uri']
+        # ids are positions in load order, a stale URL must not get another photo
+        try:
+            if get_digest(filename) != digest:
+                abort(404)
+        except OSError as e:
+            logging.warning(f'Could not serve photo {photo_id}: {e}')
+            abort(404)
+        try:
+            if variant == 'original':
+                path, etag = get_media(filename, variant)
+                response = send_file(
+                    path, add_etags=False, cache_timeout=MEDIA_MAX_AGE)
+                hit = False
+            else:
+                (etag, data), hit = get_media_bytes(filename, variant)
+                response = Response(data, mimetype='image/jpeg')
+                response.cache_control.max_age = MEDIA_MAX_AGE
+        except (OSError, ValueError) as e:
+            logging.warning(f'Could not serve photo {photo_id}: {e}')
+            abort(404)
+
+        response.set_etag(etag)
+        response.cache_control.public = True
+
+        lookups = _byte_cache_stats['hits'] + _byte_cache_stats['misses']
+        logging.info(
+            f'Served {variant} {photo_id} ({"hit" if hit else "miss"}) in {1000*(time.time()-t0):.1f} ms, '
+            f'cache: {len(_byte_cache)} images, {_byte_cache_stats["bytes"] / 2**20:.1f} MiB, '
+            f'hit rate {_byte_cache_stats["hits"] / max(lookups, 1):.0%}')
+
+        return response.make_conditional(request)
@@ -0,0 +1,148 @@
+import sys
+import threading
+from functools import wraps
+from collections import OrderedDict, defaultdict
+
+import numpy as np
+import pandas as pd
+from flask import jsonify
+from plotly.basedatatypes import BaseFigure
+from dash.development.base_component import Component
+
+from config import MEMO_MAX_ENTRIES, MEMO_MAX_BYTES
+
+# Results of memoized functions, keyed on (function, normalized arguments, data version).
+# Arguments that are not hashable (frames, graphs, ...) are keyed on their identity, the entry
+# keeps a reference to them so that identity cannot be reused while the entry is alive.
+_cache = OrderedDict()
+_cache_bytes = 0
+_cache_lock = threading.Lock()
+_stats = defaultdict(lambda: {'hits': 0, 'misses': 0, 'evictions': 0})
+
+_data_version = 0
+
+
+def bump_data_version():
+    """Call whenever the loaded data changes, invalidates every memoized result"""
+
+    global _data_version
+    _data_version += 1
+
+
+def _normalize(arg, refs):
+    # exact types only: subclasses such as namedtuples holding whole indexes are keyed on identity
+    if isinstance(arg, (str, bytes, int, float, bool, type(None))):
+        return arg
+    if type(arg) in (list, tuple):
+        return tuple(_normalize(item, refs) for item in arg)
+    if type(arg) in (set, frozenset):
+        return tuple(sorted(_normalize(item, refs) for item in arg))
+    if type(arg) is dict:
+        return tuple(sorted((key, _normalize(value, refs)) for key, value in arg.items()))
+    refs.append(arg)
+    return ('id', type(arg).__name__, id(arg))
+
+
+def _sizeof(value):
+    """Bytes held by value: frames and arrays by their buffers, figures by their data, containers
+    and Dash component trees by everything in them. Shared objects are counted once.
+    Frames are sized shallowly: the strings of their object columns are mostly borrowed from the
+    loaded messages, and walking them would touch pages the gunicorn workers share copy-on-write"""
+
+    size = 0
+    seen = set()
+    # also keeps the figure dicts made along the way alive, so their ids are not reused
+    stack = [value]
+    walked = []
+    while stack:
+        value = stack.pop()
+        if id(value) in seen:
+            continue
+        seen.add(id(value))
+        walked.append(value)
+
+        if isinstance(value, (pd.DataFrame, pd.Series)):
+            size += int(np.sum(value.memory_usage(index=True)))
+        elif isinstance(value, pd.Index):
+            size += value.memory_usage()
+        elif isinstance(value, np.ndarray):
+            size += value.nbytes
+            # views borrow their objects
+            if value.dtype == object and value.base is None:
+                stack.extend(value.ravel())
+        elif isinstance(value, BaseFigure):
+            stack.append(value.to_dict())
+        elif isinstance(value, Component):
+            size += sys.getsizeof(value)
+            stack.extend(value.to_plotly_json()['props'].values())
+        elif isinstance(value, (list, tuple, set, frozenset)):
+            size += sys.getsizeof(value)
+            stack.extend(value)
+        elif isinstance(value, dict):
+            size += sys.getsizeof(value)
+            stack.extend(value.keys())
+            stack.extend(value.values())
+        else:
+            size += sys.getsizeof(value)
+    return size
+
+
+def _evict():
+    global _cache_bytes
+    # the newest entry stays, even when it alone is over budget
+    while len(_cache) > 1 and (len(_cache) > MEMO_MAX_ENTRIES or _cache_bytes > MEMO_MAX_BYTES):
+        key, (_, size, _) = _cache.popitem(last=False)
+        _cache_bytes -= size
+        _stats[key[0]]['evictions'] += 1
+
+
+def memoize(func):
+    """Caches the results of func in the shared, bounded LRU cache"""
+
+    name = f'{func.__module__}.{func.__qualname__}'
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        global _cache_bytes
+        refs = []
+        key = (name, _normalize(args, refs),
+               _normalize(kwargs, refs), _data_version)
+
+        with _cache_lock:
+            if key in _cache:
+                _cache.move_to_end(key)
+                _stats[name]['hits'] += 1
+                return _cache[key][0]
+            _stats[name]['misses'] += 1
+
+        result = func(*args, **kwargs)
+        # the arguments kept by identity in refs are not owned by the cache
+        size = _sizeof(result) + _sizeof(key)
+
+        with _cache_lock:
+            if key not in _cache:
+                _cache[key] = (result, size, refs)
+                _cache_bytes += size
+                _evict()
+        return result
+
+    return wrapper
+
+
+def cache_stats():
+    """Hit, miss and eviction counts per memoized function, plus the size of the cache"""
+
+    with _cache_lock:
+        return {
+            'entries': len(_cache),
+            'bytes': _cache_bytes,
+            'data_version': _data_version,
+            'functions': {name: dict(stats) for name, stats in _stats.items()},
+        }
+
+
+def register_memo_route(server):
+
+    @server.route('/debug/cache')
+    def serve_cache_stats():
+        return jsonify(cache_stats())
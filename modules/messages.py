@@ -1,19 +1,33 @@
 import string
-import time
-import os
-import logging
 import numpy as np
-import math
-from collections import Counter
+from collections import namedtuple
 
-import nltk
-from nltk import sent_tokenize, word_tokenize, PorterStemmer
 from nltk.corpus import stopwords
 
 import pandas as pd
 from pandas.api.types import CategoricalDtype
+from scipy import sparse
 
-from config import BORING_WORDS, MY_NAME, MSG_DIR
+from config import BORING_WORDS, MY_NAME
+
+from modules.tokens import get_token_ids, get_message_lengths
+from modules.memo import memoize
+from modules.perf import timed
+from modules.sketches import select_sketches, estimate_distinct, estimate_avg_word_length
+
+GRANULARITIES = {
+    'Hourly': 'H',
+    'Daily': 'D',
+    'Monthly': 'MS',
+    'Yearly': 'YS',
+}
+
+# columns of get_contact_stats
+CONTACT_STATS_COLUMNS = ['Name', 'Message Count',
+                         'Vocab. size', 'Avg. word length', 'Avg. words per msg']
+
+# Row ranges (start, stop) of every chat title, and of every (title, sender_name), in a frame grouped by chat
+ChatIndex = namedtuple('ChatIndex', ['titles', 'senders'])
 
 words_to_ignore = set(stopwords.words('english')).union(
     stopwords.words('dutch')).union(BORING_WORDS).union(set([x for x in string.digits + string.punctuation + string.whitespace + string.hexdigits + string.octdigits]))
@@ -21,51 +35,118 @@ words_to_ignore = set(stopwords.words('english')).union(
 
 # basic stuff
 
+@memoize
 def list_chat_titles(df):
     return sorted(df.title.unique().tolist())
 
 
+@memoize
 def list_contacts(df):
     return sorted(df.sender_name.unique().tolist())
 
 
-def filter_df_on_title(df, chat_title):
+def _runs(*codes):
+    """Start and stop of every run of equal values in one or more aligned code arrays"""
+
+    changes = np.zeros(max(len(codes[0]) - 1, 0), dtype=bool)
+    for c in codes:
+        changes |= c[1:] != c[:-1]
+    boundaries = np.flatnonzero(changes) + 1
+    return np.concatenate([[0], boundaries]), np.concatenate([boundaries, [len(codes[0])]])
+
+
+@timed
+def build_chat_index(df):
+    """Row ranges per chat and per sender within a chat, df must be grouped on title and sender_name like load_data returns it"""
+
+    title_codes, titles = pd.factorize(df['title'])
+    sender_codes, senders = pd.factorize(df['sender_name'])
+
+    starts, stops = _runs(title_codes)
+    if len(starts) != len(titles):
+        raise ValueError('The messages are not grouped by chat title.')
+    title_ranges = {titles[title_codes[start]]: (int(start), int(stop))
+                    for start, stop in zip(starts, stops)}
+
+    starts, stops = _runs(title_codes, sender_codes)
+    sender_ranges = {(titles[title_codes[start]], senders[sender_codes[start]]): (int(start), int(stop))
+                     for start, stop in zip(starts, stops)}
+    if len(sender_ranges) != len(starts):
+        raise ValueError('The messages are not grouped by sender within a chat.')
+
+    return ChatIndex(titles=title_ranges, senders=sender_ranges)
+
+
+@memoize
+def filter_df_on_title(df, chat_title, chat_index=None):
+    if chat_index is not None:
+        start, stop = chat_index.titles.get(chat_title, (0, 0))
+        return df.iloc[start:stop]
     return df.loc[df.title == chat_title]
 
 
-# Global analysis
+@memoize
+def filter_df_on_sender(df, sender_name, chat_title=None, chat_index=None):
+    """Messages of sender_name, within a single chat when chat_title and its chat_index are given"""
 
+    if chat_index is not None and chat_title is not None:
+        start, stop = chat_index.senders.get((chat_title, sender_name), (0, 0))
+        return df.iloc[start:stop]
+    return df.loc[df.sender_name == sender_name]
 
-def get_msg_count_in_out(df, granularity):
 
-    sent = df.loc[df.sender_name == MY_NAME]
-    received = df.loc[df.sender_name != MY_NAME]
+def _observed(column):
+    """Drops the categories of a categorical column that do not occur in this selection"""
 
-    if granularity == 'Hourly':
-        s = sent.groupby(pd.Grouper(key='timestamp', freq='H')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
-        r = received.groupby(pd.Grouper(key='timestamp', freq='H')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
+    if pd.api.types.is_categorical_dtype(column):
+        return column.cat.remove_unused_categories()
+    return column
 
-    elif granularity == 'Daily':
-        s = sent.groupby(pd.Grouper(key='timestamp', freq='D')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
-        r = received.groupby(pd.Grouper(key='timestamp', freq='D')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
 
-    elif granularity == 'Monthly':
-        s = sent.groupby(pd.Grouper(key='timestamp', freq='MS')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
-        r = received.groupby(pd.Grouper(key='timestamp', freq='MS')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
+def _as_object(result, column):
+    """Aggregates are small, hand them out with a plain column like the rest of the app expects"""
 
-    elif granularity == 'Yearly':
-        s = sent.groupby(pd.Grouper(key='timestamp', freq='YS')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
-        r = received.groupby(pd.Grouper(key='timestamp', freq='YS')).size(
-        ).reset_index().rename(columns={0: 'msg_count'})
-    else:
+    result[column] = result[column].astype(object)
+    return result
+
+
+# Global analysis
+
+
+@timed
+def get_hourly_msg_counts(df):
+    """Returns the number of messages per hour, chat and sender. All message counts over time are rolled up from this"""
+
+    hours = df['timestamp'].dt.floor('H')
+    result = df.groupby([hours, 'title', 'sender_name'], observed=True).size(
+    ).reset_index().rename(columns={0: 'msg_count'})
+    result['type'] = pd.Categorical(
+        np.where(result.sender_name == MY_NAME, 'sent', 'received'))
+
+    # grouped by chat like the messages, so build_chat_index applies
+    return result.sort_values(['title', 'sender_name', 'timestamp'], ignore_index=True)
+
+
+def _get_freq(granularity):
+    if granularity not in GRANULARITIES:
         raise NotImplementedError()
+    return GRANULARITIES[granularity]
+
+
+@timed
+@memoize
+def get_msg_count_in_out(msg_counts, granularity):
+    """Returns the number of messages sent and received per interval, given the output of get_hourly_msg_counts"""
+
+    freq = _get_freq(granularity)
+
+    sent = msg_counts.loc[msg_counts.type == 'sent']
+    received = msg_counts.loc[msg_counts.type == 'received']
+
+    s = sent.groupby(pd.Grouper(key='timestamp', freq=freq))[
+        'msg_count'].sum().reset_index()
+    r = received.groupby(pd.Grouper(key='timestamp', freq=freq))[
+        'msg_count'].sum().reset_index()
 
     s['type'] = 'sent'
     r['type'] = 'received'
@@ -75,6 +156,8 @@ def get_msg_count_in_out(df, granularity):
     return results
 
 
+@timed
+@memoize
 def get_weekly_activity_pattern(df):
     selected = df.loc[df.sender_name == MY_NAME]
 
@@ -92,10 +175,12 @@ def get_weekly_activity_pattern(df):
     return result
 
 
+@timed
+@memoize
 def get_total_msg_count_per_contact(df):
     """Returns the number of messages sent by every contact"""
 
-    result = df.groupby('sender_name').size().reset_index().rename(
+    result = df.groupby(_observed(df['sender_name'])).size().reset_index().rename(
         columns={0: 'msg_count'}).sort_values(by='msg_count', ascending=False)
 
     my_count = result.loc[result.sender_name == MY_NAME].msg_count.tolist()[0]
@@ -108,21 +193,21 @@ def get_total_msg_count_per_contact(df):
 
 # Analysis per chat
 
-def get_msg_count_per_contact(df, granularity):
-    """ Returns the number of messages sent per user within a predefined interval """
-
-    if granularity == 'Hourly':
-        return df.groupby(by=[pd.Grouper(key='timestamp', freq='H'), 'sender_name']).size().reset_index().rename(columns={0: 'msg_count'})
-    elif granularity == 'Daily':
-        return df.groupby(by=[pd.Grouper(key='timestamp', freq='D'), 'sender_name']).size().reset_index().rename(columns={0: 'msg_count'})
-    elif granularity == 'Monthly':
-        return df.groupby(by=[pd.Grouper(key='timestamp', freq='MS'), 'sender_name']).size().reset_index().rename(columns={0: 'msg_count'})
-    elif granularity == 'Yearly':
-        return df.groupby(by=[pd.Grouper(key='timestamp', freq='YS'), 'sender_name']).size().reset_index().rename(columns={0: 'msg_count'})
-    else:
-        raise NotImplementedError
+@timed
+@memoize
+def get_msg_count_per_contact(msg_counts, granularity):
+    """ Returns the number of messages sent per user within a predefined interval, given (a selection of) the output of get_hourly_msg_counts """
+
+    freq = _get_freq(granularity)
+    result = msg_counts.groupby(by=[pd.Grouper(key='timestamp', freq=freq), 'sender_name'], observed=True)[
+        'msg_count'].sum().reset_index()
 
+    # observed=True keeps the order of appearance within a time bucket, restore the sorted order
+    return _as_object(result, 'sender_name').sort_values(['timestamp', 'sender_name'], ignore_index=True)
 
+
+@timed
+@memoize
 def get_msg_distribution_per_contact(df, timeframe):
     """Returns the total nb of messages sent per day of the week, or per hour of the day"""
 
@@ -131,74 +216,121 @@ def get_msg_distribution_per_contact(df, timeframe):
                 'Thursday', 'Friday', 'Saturday', 'Sunday']
         cat_type = CategoricalDtype(categories=days, ordered=True)
         weekdays = df['timestamp'].dt.day_name().astype(cat_type)
-        result = df.groupby([weekdays, 'sender_name']).size(
+        result = df.groupby([weekdays, _observed(df['sender_name'])]).size(
         ).reset_index().rename(columns={0: 'msg_count'})
-        return result
+        return _as_object(result, 'sender_name')
 
     elif timeframe == 'Hour of Day':
         hours = range(24)
         cat_type = CategoricalDtype(categories=hours, ordered=True)
         day_hours = df['timestamp'].dt.hour.astype(cat_type)
-        return df.groupby([day_hours, 'sender_name']).size().reset_index().rename(columns={0: 'msg_count'})
+        result = df.groupby([day_hours, _observed(df['sender_name'])]).size(
+        ).reset_index().rename(columns={0: 'msg_count'})
+        return _as_object(result, 'sender_name')
     else:
         raise NotImplementedError
 
 
-def get_wordcount(df):
+@timed
+@memoize
+def get_wordcount(df, token_index):
     "returns the word count of all messages in this df, sorted by descending frequency"
 
-    results = Counter()
-    text = df['content'].str.lower().dropna().apply(
-        nltk.word_tokenize).apply(' '.join)
-    counted = Counter(" ".join(text.values.tolist()).split(" ")).items()
-    filtered = {
-        x: y for x, y in counted if not x in words_to_ignore}
-    result = sorted([(k, v) for k, v in filtered.items()],
-                    key=lambda item: item[1], reverse=True)
+    ids = get_token_ids(token_index, df)
+    unique_ids, first_seen, counts = np.unique(
+        ids, return_index=True, return_counts=True)
+
+    # ties are ranked by first occurrence
+    order = np.lexsort((first_seen, -counts))
+    result = [(token_index.vocab[i], int(c))
+              for i, c in zip(unique_ids[order], counts[order])]
     return result
 
 # Contact analysis
 
 
-def _tokenize_all_content(df):
-    return list(set(nltk.word_tokenize(' '.join(df['content'].str.lower().dropna().values.tolist()))).difference(words_to_ignore))
+def _tokenize_all_content(df, token_index):
+    return np.unique(get_token_ids(token_index, df))
+
 
+def _avg_words_per_message(df, token_index):
+    return np.mean(get_message_lengths(token_index, df.loc[df['content'].notna()]))
 
-def _avg_words_per_message(df):
-    return np.mean([len(x) for x in df['content'].str.lower().dropna().apply(nltk.word_tokenize).values.tolist()])
 
+@timed
+@memoize
+def get_contact_stats(df, selected_contacts, token_index, sketches=None):
+    """Stats of every selected contact, read from their sketches (see modules/sketches.py),
+    or computed exactly from all their messages when no sketches are given"""
 
-def get_contact_stats(df, selected_contacts):
+    if sketches is not None:
+        names = sorted(set(selected_contacts).intersection(sketches.positions))
+        if not names:
+            return pd.DataFrame(columns=CONTACT_STATS_COLUMNS)
+        rows = select_sketches(sketches, names)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            words_per_msg = np.where(rows.texts > 0, rows.tokens / rows.texts, np.nan)
+        return pd.DataFrame({
+            'Name': names,
+            'Message Count': rows.messages,
+            'Vocab. size': np.round(estimate_distinct(rows.registers)).astype(np.int64),
+            'Avg. word length': estimate_avg_word_length(rows),
+            'Avg. words per msg': words_per_msg,
+        })
 
     selection = df.loc[df.sender_name.isin(selected_contacts)]
-    grouper = selection.groupby('sender_name')
-    stats = grouper.size().reset_index().rename(
-        columns={'sender_name': 'Name', 0: 'Message Count'})
+    grouper = selection.groupby(_observed(selection['sender_name']))
+    stats = _as_object(grouper.size().reset_index().rename(
+        columns={'sender_name': 'Name', 0: 'Message Count'}), 'Name')
 
-    tokenized = grouper.apply(_tokenize_all_content)
+    groups = [group for _, group in grouper]
+    tokenized = [_tokenize_all_content(group, token_index) for group in groups]
 
-    stats['Vocab. size'] = tokenized.apply(set).apply(len).values
-    stats['Avg. word length'] = tokenized.apply(
-        lambda words: np.mean([len(word) for word in words])).values
-    stats['Avg. words per msg'] = grouper.apply(
-        _avg_words_per_message).values
+    stats['Vocab. size'] = [len(ids) for ids in tokenized]
+    stats['Avg. word length'] = [
+        np.mean(token_index.word_lengths[ids]) for ids in tokenized]
+    stats['Avg. words per msg'] = [
+        _avg_words_per_message(group, token_index) for group in groups]
 
     return stats
 
 
-def get_weighted_adjacency_matrix(df):
+@timed
+def get_sparse_adjacency_matrix(df):
+    """Returns the contacts and a sparse matrix with, for every pair of contacts sharing a chat,
+    the number of messages the first one sent to chats with the second one"""
 
-    msgs_per_sender_per_title = df.groupby(['sender_name', 'title']).size(
-    ).reset_index().rename(columns={0: 'msg_count'})
+    senders, names = pd.factorize(df['sender_name'], sort=True)
+    titles, _ = pd.factorize(df['title'], sort=True)
+
+    # msgs per sender per title, duplicate coordinates are summed
+    msg_count = sparse.coo_matrix(
+        (np.ones(len(df), dtype=np.int64), (senders, titles)),
+        shape=(len(names), titles.max() + 1)).tocsr()
+    members = (msg_count > 0).astype(np.int64).T
 
-    receivers_per_title = df[['title', 'sender_name']].rename(
-        columns={'sender_name': 'receiver_name'})
+    connectivity = (msg_count @ members).tocsr()
+    connectivity.setdiag(0)
+    connectivity.eliminate_zeros()
 
-    combined = msgs_per_sender_per_title.merge(receivers_per_title, on='title')
-    combined = combined[combined['sender_name'] !=
-                        combined['receiver_name']].drop_duplicates().drop(columns='title')
+    # like the dense version, leave out contacts that never shared a chat with anyone
+    connected = np.flatnonzero(connectivity.getnnz(axis=1))
+    connectivity = connectivity[connected][:, connected]
+
+    return [names[i] for i in connected], connectivity
+
+
+def to_dense_adjacency(connectivity):
+    """Dense version of a sparse adjacency matrix, with NaN for pairs that never shared a chat"""
+
+    dense = connectivity.toarray().astype(np.float64)
+    dense[dense == 0] = np.nan
+    return dense
+
+
+@timed
+def get_weighted_adjacency_matrix(df):
 
-    connectivity = combined.groupby(['sender_name', 'receiver_name'])[
-        'msg_count'].sum().unstack()
+    names, connectivity = get_sparse_adjacency_matrix(df)
 
-    return connectivity.columns.tolist(), connectivity.values
+    return names, to_dense_adjacency(connectivity)
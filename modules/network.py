@@ -1,38 +1,149 @@
+import json
+import time
+import logging
+
+import plotly
 import plotly.graph_objects as go
 import dash_core_components as dcc
 import dash_html_components as html
 import networkx as nx
 import numpy as np
+from scipy import sparse
+
+from modules.graph_layout import get_layout
+from modules.memo import memoize
+from modules.perf import timed
+from modules import transport
+
+# top_k: per node, keep only its heaviest edges
+# min_weight: drop lighter edges
+# collapse_degree: merge contacts with at most this many connections into one node per community
+DETAIL_LEVELS = {
+    'Full': dict(top_k=None, min_weight=0, collapse_degree=0),
+    'High': dict(top_k=20, min_weight=0, collapse_degree=0),
+    'Medium': dict(top_k=5, min_weight=10, collapse_degree=1),
+    'Low': dict(top_k=2, min_weight=50, collapse_degree=3),
+}
 
 
+@timed
 def build_graph(matrix, names):
-    G = nx.from_numpy_matrix(matrix)
-    # nx.relabel_nodes(G, {i: names[i] for i in G.nodes()})
-    pos = nx.layout.spring_layout(G)
+    if not sparse.issparse(matrix):
+        # dense matrices mark missing edges with NaN
+        matrix = sparse.csr_matrix(np.nan_to_num(matrix))
+    G = nx.from_scipy_sparse_matrix(matrix)
+    pos = get_layout(matrix, names)
+    G.graph['pos'] = pos
     for node in G.nodes:
         G.nodes[node]['name'] = names[node]
         G.nodes[node]['pos'] = list(pos[node])
     return G
 
 
-def plot_graph(G):
-    edge_x = []
-    edge_y = []
-    edge_weights = []
+def _graph_arrays(G):
+    """Positions of all nodes, and endpoints and weights of all edges (self loops and NaN weights left out)"""
+
+    nodes = list(G.nodes)
+    pos = G.graph.get('pos')
+    if pos is None:
+        pos = np.array([G.nodes[node]['pos'] for node in nodes])
+
+    matrix = nx.to_scipy_sparse_matrix(G, nodelist=nodes, dtype=np.float64)
+    matrix.data[np.isnan(matrix.data)] = 0
+    matrix.eliminate_zeros()
+
+    # every undirected edge once
+    edges = sparse.triu(matrix, k=1).tocoo()
+    node_weights = np.asarray(
+        matrix.sum(axis=1)).ravel() - matrix.diagonal()
+
+    return nodes, pos, edges.row, edges.col, edges.data, node_weights
+
+
+@memoize
+def _get_communities(G):
+    """Community id of every node, in the order of G.nodes"""
+
+    community = dict()
+    for i, members in enumerate(nx.algorithms.community.label_propagation_communities(G)):
+        community.update({node: i for node in members})
+    return np.array([community[node] for node in G.nodes])
+
+
+def _prune_edges(n, sources, targets, weights, top_k, min_weight):
+    """Keeps edges of at least min_weight that are among the top_k heaviest of one of their endpoints"""
+
+    keep = weights >= min_weight
+
+    if top_k is not None:
+        # rank every edge within the edges of both endpoints, heaviest first
+        endpoints = np.concatenate([sources, targets])
+        edge_ids = np.tile(np.arange(len(weights)), 2)
+        order = np.lexsort((-np.tile(weights, 2), endpoints))
+        starts = np.searchsorted(endpoints[order], np.arange(n))
+        ranks = np.arange(len(order)) - starts[endpoints[order]]
+        in_top_k = np.zeros(len(weights), dtype=bool)
+        in_top_k[edge_ids[order][ranks < top_k]] = True
+        keep &= in_top_k
+
+    return sources[keep], targets[keep], weights[keep]
+
+
+def _collapse_low_degree(G, pos, names, node_weights, sources, targets, weights, max_degree):
+    """Replaces all contacts with at most max_degree connections by one super-node per community"""
+
+    n = len(pos)
+    degree = np.bincount(sources, minlength=n) + \
+        np.bincount(targets, minlength=n)
+    low = degree <= max_degree
+    kept = np.flatnonzero(~low)
 
-    matrix = nx.convert.to_dict_of_dicts(G)
-    for edge in G.edges():
-        if edge[0] != edge[1] and not np.isnan(matrix[edge[0]][edge[1]]['weight']):
-            x0, y0 = G.nodes[edge[0]]['pos']
-            x1, y1 = G.nodes[edge[1]]['pos']
-            edge_x.append(x0)
-            edge_x.append(x1)
-            edge_x.append(None)
-            edge_y.append(y0)
-            edge_y.append(y1)
-            edge_y.append(None)
+    communities, community_of_low = np.unique(
+        _get_communities(G)[low], return_inverse=True)
+    new_id = np.empty(n, dtype=np.int64)
+    new_id[kept] = np.arange(len(kept))
+    new_id[low] = len(kept) + community_of_low
 
-            edge_weights.append(int(matrix[edge[0]][edge[1]]['weight']))
+    m = len(kept) + len(communities)
+    members = np.bincount(new_id, minlength=m)
+    new_pos = np.stack([np.bincount(new_id, weights=pos[:, dim], minlength=m) / members
+                        for dim in range(2)], axis=1)
+    new_node_weights = np.bincount(new_id, weights=node_weights, minlength=m)
+    _, first_low = np.unique(community_of_low, return_index=True)
+    first_member = np.flatnonzero(low)[first_low]
+    new_names = [names[i] for i in kept] + \
+        [names[i] if count == 1 else f'{count} contacts'
+         for i, count in zip(first_member, members[len(kept):])]
+
+    # sum parallel edges between (super-)nodes, drop the ones inside a super-node
+    edges = sparse.coo_matrix(
+        (weights, (new_id[sources], new_id[targets])), shape=(m, m)).tocsr()
+    edges = sparse.triu(edges + edges.T, k=1).tocoo()
+
+    return new_pos, new_names, new_node_weights, members, edges.row, edges.col, edges.data
+
+
+@timed
+def plot_graph(G, level='Full'):
+    t0 = time.time()
+    settings = DETAIL_LEVELS[level]
+
+    nodes, pos, sources, targets, weights, node_weights = _graph_arrays(G)
+    names = [G.nodes[node].get('name') for node in nodes]
+    members = np.ones(len(nodes), dtype=np.int64)
+
+    if settings['collapse_degree']:
+        pos, names, node_weights, members, sources, targets, weights = _collapse_low_degree(
+            G, pos, names, node_weights, sources, targets, weights, settings['collapse_degree'])
+
+    sources, targets, weights = _prune_edges(
+        len(pos), sources, targets, weights, settings['top_k'], settings['min_weight'])
+
+    # line segments separated by gaps: x0, x1, NaN, x0, x1, NaN, ...
+    gaps = np.full(len(sources), np.nan)
+    edge_x = np.column_stack([pos[sources, 0], pos[targets, 0], gaps]).ravel()
+    edge_y = np.column_stack([pos[sources, 1], pos[targets, 1], gaps]).ravel()
+    edge_weights = weights.astype(np.int64)
 
     edge_trace = go.Scatter(
         x=edge_x, y=edge_y,
@@ -45,21 +156,11 @@ def plot_graph(G):
 
     edge_trace.marker.line.color = edge_weights
 
-    node_x = []
-    node_y = []
-    node_weights = []
-    node_text = []
-
-    for node, adjacencies in enumerate(G.adjacency()):
-        x, y = G.nodes[node]['pos']
-        node_x.append(x)
-        node_y.append(y)
-
-        sum_of_edge_weights = int(sum([y['weight']
-                                       for y in adjacencies[1].values() if not np.isnan(y['weight'])]))
-        node_weights.append(sum_of_edge_weights)
-        node_text.append(f'{G.nodes[node].get("name")}\n \
-                         #messages: {sum_of_edge_weights}')
+    node_x = pos[:, 0]
+    node_y = pos[:, 1]
+    node_weights = node_weights.astype(np.int64)
+    node_text = [f'{name}\n \
+                         #messages: {weight}' for name, weight in zip(names, node_weights)]
 
     node_trace = go.Scatter(
         x=node_x, y=node_y,
@@ -72,7 +173,7 @@ def plot_graph(G):
             color=node_weights,
             cmax=np.percentile(node_weights, 95),
             cmin=10,
-            size=10,
+            size=10 + 2 * np.sqrt(members - 1),
             colorbar=dict(
                 thickness=15,
                 title='# Connections',
@@ -92,4 +193,27 @@ def plot_graph(G):
         yaxis=dict(showgrid=False, zeroline=False, showticklabels=False))
     )
 
+    logging.info(
+        f'Network graph at detail level {level}: {len(pos)} nodes, {len(weights)} edges, '
+        f'built in {time.time()-t0:.4f} seconds.')
+
     return fig
+
+
+def get_graph_payload(G, level='Full'):
+    """plot_graph encoded for the network-graph-data store, built once per graph, detail level and encoding"""
+
+    return _encode_graph(G, level, transport.BINARY_FIGURES)
+
+
+@memoize
+def _encode_graph(G, level, binary):
+    t0 = time.time()
+    payload = transport.encode_figure(plot_graph(G, level), binary)
+
+    # serialized once per level, requests reuse the memoized payload
+    logging.info(
+        f'Network graph payload at detail level {level}: '
+        f'{len(json.dumps(payload, cls=plotly.utils.PlotlyJSONEncoder))} bytes, '
+        f'built in {time.time()-t0:.4f} seconds.')
+    return payload
@@ -0,0 +1,170 @@
+import os
+import re
+import time
+import logging
+import cProfile
+import threading
+from functools import wraps
+from contextlib import contextmanager
+from collections import defaultdict, deque
+
+import numpy as np
+from flask import g, jsonify, request
+
+from config import PERF_SAMPLES, PERF_SLOW_SECONDS, PERF_PROFILE, PERF_PROFILE_DIR
+
+try:
+    from pyinstrument import Profiler
+except ImportError:
+    Profiler = None
+
+# recent durations (seconds) per timer and response sizes (bytes) per callback
+_timings = defaultdict(lambda: deque(maxlen=PERF_SAMPLES))
+_payloads = defaultdict(lambda: deque(maxlen=PERF_SAMPLES))
+_lock = threading.Lock()
+
+# per thread: the depth of nested timed calls and the breakdowns of the stages that are running
+_local = threading.local()
+
+CALLBACK_ROUTE = '/_dash-update-component'
+
+
+def record(name, seconds):
+    with _lock:
+        _timings[name].append(seconds)
+
+    depth = getattr(_local, 'depth', 0)
+    if depth == 0:
+        # only outermost calls count towards a stage, nested ones are part of them
+        for breakdown in getattr(_local, 'stages', []):
+            breakdown.append((name, seconds))
+    if seconds > PERF_SLOW_SECONDS:
+        logging.info(f'{name} took {seconds:.4f} seconds.')
+
+
+def timed(func):
+    """Records the duration of every call of func"""
+
+    name = f'{func.__module__}.{func.__name__}'
+
+    @wraps(func)
+    def wrapper(*args, **kwargs):
+        _local.depth = getattr(_local, 'depth', 0) + 1
+        t0 = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            _local.depth -= 1
+            record(name, time.perf_counter() - t0)
+
+    return wrapper
+
+
+def _start_profiler():
+    if PERF_PROFILE == 'cprofile':
+        profiler = cProfile.Profile()
+        profiler.enable()
+        return profiler
+    if PERF_PROFILE == 'pyinstrument' and Profiler is not None:
+        profiler = Profiler()
+        profiler.start()
+        return profiler
+    return None
+
+
+def _stop_profiler(profiler, name):
+    """Writes the profile to PERF_PROFILE_DIR: .prof files for cProfile (open with pstats or snakeviz), .html for pyinstrument"""
+
+    if profiler is None:
+        return
+    os.makedirs(PERF_PROFILE_DIR, exist_ok=True)
+    path = os.path.join(PERF_PROFILE_DIR, re.sub(
+        r'[^\w-]+', '_', name).strip('_') + f'-{int(time.time() * 1000)}')
+
+    if isinstance(profiler, cProfile.Profile):
+        profiler.disable()
+        profiler.dump_stats(path + '.prof')
+    else:
+        profiler.stop()
+        with open(path + '.html', 'w') as f:
+            f.write(profiler.output_html())
+
+
+@contextmanager
+def stage(name):
+    """Times (and profiles, if enabled) a block, logs its duration and that of the timed calls inside"""
+
+    breakdown = []
+    _local.stages = getattr(_local, 'stages', []) + [breakdown]
+    profiler = _start_profiler()
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        seconds = time.perf_counter() - t0
+        _stop_profiler(profiler, name)
+        _local.stages = _local.stages[:-1]
+        with _lock:
+            _timings[name].append(seconds)
+
+        details = ', '.join(f'{call.rsplit(".", 1)[-1]} {duration:.4f}'
+                            for call, duration in breakdown)
+        logging.info(
+            f'{name} took {seconds:.4f} seconds' + (f' ({details}).' if details else '.'))
+
+
+def _percentiles(values, scale):
+    values = np.array(values) * scale
+    return {
+        'count': len(values),
+        'p50': float(np.percentile(values, 50)),
+        'p90': float(np.percentile(values, 90)),
+        'p99': float(np.percentile(values, 99)),
+        'max': float(values.max()),
+    }
+
+
+def perf_stats():
+    """Percentiles of the recent durations (ms) of every timer, and of the response sizes (bytes) of every callback"""
+
+    with _lock:
+        timings = {name: list(values) for name, values in _timings.items()}
+        payloads = {name: list(values) for name, values in _payloads.items()}
+
+    return {
+        'profile': PERF_PROFILE or None,
+        'timers_ms': {name: _percentiles(values, 1000) for name, values in sorted(timings.items())},
+        'payload_bytes': {name: _percentiles(values, 1) for name, values in sorted(payloads.items())},
+    }
+
+
+def register_perf_route(server):
+    """Times and measures every callback request, serves the summary on /debug/perf"""
+
+    if PERF_PROFILE == 'pyinstrument' and Profiler is None:
+        logging.warning(
+            'PERF_PROFILE is pyinstrument, but it is not installed: pip install pyinstrument')
+
+    @server.before_request
+    def start_callback_timer():
+        if request.path == CALLBACK_ROUTE:
+            body = request.get_json(silent=True) or {}
+            g.perf_callback = f'callback {body.get("output", "?")}'
+            g.perf_profiler = _start_profiler()
+            g.perf_start = time.perf_counter()
+
+    @server.after_request
+    def stop_callback_timer(response):
+        if request.path == CALLBACK_ROUTE and 'perf_start' in g:
+            # includes serializing the figures to JSON, unlike the timer of the callback function itself
+            record(g.perf_callback, time.perf_counter() - g.perf_start)
+            _stop_profiler(g.perf_profiler, g.perf_callback)
+            if not response.direct_passthrough:
+                with _lock:
+                    _payloads[g.perf_callback].append(
+                        response.content_length or len(response.get_data()))
+        return response
+
+    @server.route('/debug/perf')
+    def serve_perf_stats():
+        return jsonify(perf_stats())
@@ -0,0 +1,138 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from modules.perf import timed
+from modules.tokens import get_token_ids
+
+# Summary of the messages of one contact, built once, mergeable with the sketch of other messages.
+# registers is a HyperLogLog sketch of the distinct (not ignored) words used, word_lengths holds the
+# length of the word that set each register: a uniform sample of the distinct words.
+ContactSketch = namedtuple(
+    'ContactSketch', ['messages', 'texts', 'tokens', 'registers', 'word_lengths'])
+
+# The sketches of all contacts: rows is a ContactSketch of arrays with a row per contact,
+# positions maps every contact to its row. Memoized functions key it on its identity
+ContactSketches = namedtuple('ContactSketches', ['positions', 'rows'])
+
+# 2**PRECISION registers per sketch, the relative error of the distinct count is about 1.04 / 2**(PRECISION/2)
+PRECISION = 10
+REGISTERS = 2 ** PRECISION
+
+
+def _hash(values):
+    """splitmix64 of every value, a well mixed 64 bit hash that needs no python loop"""
+
+    with np.errstate(over='ignore'):
+        x = values.astype(np.uint64) + np.uint64(0x9E3779B97F4A7C15)
+        x = (x ^ (x >> np.uint64(30))) * np.uint64(0xBF58476D1CE4E5B9)
+        x = (x ^ (x >> np.uint64(27))) * np.uint64(0x94D049BB133111EB)
+        return x ^ (x >> np.uint64(31))
+
+
+def _registers_and_ranks(ids):
+    """Register of every id, and the position of the first set bit in the rest of its hash"""
+
+    hashes = _hash(ids)
+    registers = (hashes >> np.uint64(64 - PRECISION)).astype(np.int64)
+    rest = hashes << np.uint64(PRECISION)
+
+    # leading zeros of rest, by halving: no bit counting in numpy
+    ranks = np.ones(len(ids), dtype=np.int64)
+    for shift in (32, 16, 8, 4, 2, 1):
+        empty = (rest >> np.uint64(64 - shift)) == 0
+        ranks[empty] += shift
+        rest[empty] <<= np.uint64(shift)
+    ranks[rest == 0] = 64 - PRECISION + 1
+    return registers, ranks
+
+
+def merge_sketches(a, b):
+    """The sketch of the messages of both a and b"""
+
+    b_wins = b.registers > a.registers
+    return ContactSketch(
+        messages=a.messages + b.messages,
+        texts=a.texts + b.texts,
+        tokens=a.tokens + b.tokens,
+        registers=np.maximum(a.registers, b.registers),
+        word_lengths=np.where(b_wins, b.word_lengths, a.word_lengths),
+    )
+
+
+def select_sketches(sketches, names):
+    """The sketches of names as rows, to estimate all of them at once"""
+
+    rows = [sketches.positions[name] for name in names]
+    return ContactSketch(*(field[rows] for field in sketches.rows))
+
+
+def get_sketch(sketches, name):
+    """The sketch of one contact"""
+
+    row = sketches.positions[name]
+    return ContactSketch(*(field[row] for field in sketches.rows))
+
+
+def estimate_distinct(registers):
+    """HyperLogLog estimate of the number of distinct words, with linear counting for small counts.
+    Estimates every row of stacked registers"""
+
+    alpha = 0.7213 / (1 + 1.079 / REGISTERS)
+    estimate = alpha * REGISTERS ** 2 / \
+        np.sum(2.0 ** -registers.astype(np.float64), axis=-1)
+    zeros = np.count_nonzero(registers == 0, axis=-1)
+    with np.errstate(divide='ignore'):
+        linear = REGISTERS * np.log(REGISTERS / zeros)
+    return np.where((estimate <= 2.5 * REGISTERS) & (zeros > 0), linear, estimate)
+
+
+def estimate_avg_word_length(sketch):
+    """Average length of the distinct words, over the words that set the registers, of every row of stacked sketches"""
+
+    used = sketch.registers > 0
+    with np.errstate(invalid='ignore'):
+        return np.sum(np.where(used, sketch.word_lengths, 0), axis=-1) / np.count_nonzero(used, axis=-1)
+
+
+@timed
+def build_contact_sketches(df, token_index):
+    """Sketch of every sender in df, in one pass over all messages and tokens"""
+
+    senders, names = pd.factorize(df['sender_name'], sort=True)
+    positions = token_index.labels.get_indexer(df.index)
+    lengths = token_index.offsets[positions + 1] - token_index.offsets[positions]
+    has_text = df['content'].notna().values
+
+    messages = np.bincount(senders, minlength=len(names))
+    texts = np.bincount(senders, weights=has_text, minlength=len(names))
+    tokens = np.bincount(senders, weights=lengths * has_text, minlength=len(names))
+
+    # every distinct (sender, word) pair once, then the word of highest rank per (sender, register)
+    ids = get_token_ids(token_index, df, ignore=False).astype(np.int64)
+    token_senders = np.repeat(senders, lengths)
+    wanted = ~token_index.ignored[ids]
+    pairs = np.unique(token_senders[wanted] * len(token_index.vocab) + ids[wanted])
+    pair_senders, pair_ids = np.divmod(pairs, len(token_index.vocab))
+
+    pair_registers, pair_ranks = _registers_and_ranks(pair_ids)
+    order = np.lexsort((pair_ranks, pair_registers, pair_senders))
+    cells = pair_senders[order] * REGISTERS + pair_registers[order]
+    last = np.ones(len(cells), dtype=bool)
+    last[:-1] = cells[1:] != cells[:-1]
+
+    registers = np.zeros((len(names), REGISTERS), dtype=np.uint8)
+    word_lengths = np.zeros((len(names), REGISTERS), dtype=np.uint16)
+    registers.flat[cells[last]] = pair_ranks[order][last]
+    word_lengths.flat[cells[last]] = token_index.word_lengths[pair_ids[order][last]]
+
+    logging.info(
+        f'Sketched {len(names)} contacts, {len(pairs)} distinct (contact, word) pairs.')
+
+    return ContactSketches(
+        positions={name: i for i, name in enumerate(names)},
+        rows=ContactSketch(messages, texts.astype(np.int64), tokens.astype(np.int64),
+                           registers, word_lengths),
+    )
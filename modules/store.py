@@ -0,0 +1,142 @@
+import time
+import logging
+import threading
+from collections import OrderedDict
+
+from modules.perf import stage
+
+# Everything the app derives from the data, built in the background after the server starts.
+# Every step builds one or more named artifacts from the artifacts it depends on, in the
+# order they were defined. Lazy steps are skipped by the loader and built on first request.
+_steps = OrderedDict()
+_values = {}
+_changed = threading.Condition()
+_loader = None
+
+
+def define_artifact(names, builder, dependencies=(), lazy=False):
+    """Registers builder(*dependencies) as the step producing names (a name, or a tuple of names to unpack the result into)"""
+
+    names = (names,) if isinstance(names, str) else tuple(names)
+    step = {
+        'names': names,
+        'builder': builder,
+        'dependencies': tuple(dependencies),
+        'lazy': lazy,
+        'state': 'pending',
+        'started': None,
+        'seconds': None,
+        'error': None,
+    }
+    for name in names:
+        _steps[name] = step
+
+
+def _build(step):
+    with _changed:
+        if step['state'] != 'pending':
+            return
+        step['state'] = 'building'
+        step['started'] = time.time()
+
+    values = {}
+    try:
+        args = [get_artifact(name) for name in step['dependencies']]
+    except RuntimeError as e:
+        # the failed dependency has logged its error already
+        state, error = 'failed', str(e)
+    else:
+        try:
+            with stage(f'Building {", ".join(step["names"])}'):
+                result = step['builder'](*args)
+            values = dict(zip(step['names'], result)) if len(
+                step['names']) > 1 else {step['names'][0]: result}
+            state, error = 'ready', None
+        except Exception as e:
+            logging.exception(f'Could not build {", ".join(step["names"])}')
+            state, error = 'failed', str(e) or type(e).__name__
+
+    with _changed:
+        _values.update(values)
+        step['state'] = state
+        step['error'] = error
+        step['seconds'] = time.time() - step['started']
+        _changed.notify_all()
+
+
+def _unique_steps():
+    return list(OrderedDict((id(step), step) for step in _steps.values()).values())
+
+
+def _load_all():
+    for step in _unique_steps():
+        if not step['lazy']:
+            _build(step)
+
+
+def start_loading():
+    """Builds all steps that are not lazy in a background thread, returns immediately"""
+
+    global _loader
+    _loader = threading.Thread(target=_load_all, name='loader', daemon=True)
+    _loader.start()
+
+
+def get_artifact(name):
+    """Returns an artifact, waiting for the loader or building it now if nobody else will"""
+
+    step = _steps[name]
+    with _changed:
+        waiting = step['state'] == 'building' or (
+            step['state'] == 'pending' and not step['lazy'] and _loader is not None and _loader.is_alive())
+    if not waiting:
+        _build(step)
+
+    with _changed:
+        while step['state'] in ('pending', 'building'):
+            _changed.wait()
+        if step['state'] == 'failed':
+            raise RuntimeError(f'{name} is not available: {step["error"]}')
+        return _values[name]
+
+
+def request_artifacts(*names):
+    """Starts building the lazy artifacts among names in the background, returns whether all of names are ready"""
+
+    for name in names:
+        step = _steps[name]
+        if step['lazy'] and step['state'] == 'pending':
+            threading.Thread(target=_build, args=(step,),
+                             name=f'build {name}', daemon=True).start()
+    return is_ready(*names)
+
+
+def is_ready(*names):
+    with _changed:
+        return all(_steps[name]['state'] == 'ready' for name in names)
+
+
+def loading_status(*names):
+    """State and build time (so far) of the steps producing names"""
+
+    status = []
+    with _changed:
+        steps = [_steps[name] for name in names]
+        for step in OrderedDict((id(step), step) for step in steps).values():
+            seconds = step['seconds']
+            if step['state'] == 'building':
+                seconds = time.time() - step['started']
+            status.append({
+                'names': step['names'],
+                'state': step['state'],
+                'seconds': seconds,
+                'error': step['error'],
+            })
+    return status
+
+
+def wait_for_all():
+    """Builds every artifact, lazy ones included, raises if any of them failed"""
+
+    for step in _unique_steps():
+        get_artifact(step['names'][0])
@@ -0,0 +1,91 @@
+import logging
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+
+import nltk
+import numpy as np
+
+from config import LOAD_WORKERS
+from modules.perf import timed
+
+# The words of all messages, tokenized once. Message i (at position i of labels) consists of
+# the vocabulary ids ids[offsets[i]:offsets[i+1]], ignored masks the ids in words_to_ignore.
+TokenIndex = namedtuple(
+    'TokenIndex', ['labels', 'vocab', 'word_lengths', 'ignored', 'ids', 'offsets'])
+
+CHUNK_SIZE = 10000
+
+
+def _tokenize_chunk(contents):
+    return [nltk.word_tokenize(content) for content in contents]
+
+
+def _tokenize(contents):
+    """Yields the tokens of every message, in the order of contents"""
+
+    chunks = [contents[i:i + CHUNK_SIZE]
+              for i in range(0, len(contents), CHUNK_SIZE)]
+
+    if LOAD_WORKERS <= 1 or len(chunks) <= 1:
+        for chunk in map(_tokenize_chunk, chunks):
+            yield from chunk
+        return
+
+    with ProcessPoolExecutor(max_workers=LOAD_WORKERS) as executor:
+        for chunk in executor.map(_tokenize_chunk, chunks):
+            yield from chunk
+
+
+@timed
+def build_token_index(df, words_to_ignore):
+    """Tokenizes the content of every message in df"""
+
+    contents = df['content'].str.lower().fillna('').tolist()
+
+    vocab = {}
+    ids = []
+    lengths = np.zeros(len(contents), dtype=np.int64)
+
+    for i, tokens in enumerate(_tokenize(contents)):
+        lengths[i] = len(tokens)
+        ids.extend(vocab.setdefault(token, len(vocab)) for token in tokens)
+
+    words = list(vocab)
+    offsets = np.zeros(len(contents) + 1, dtype=np.int64)
+    np.cumsum(lengths, out=offsets[1:])
+
+    logging.info(
+        f'Tokenized {len(contents)} messages into {len(ids)} tokens, {len(words)} distinct.')
+
+    return TokenIndex(
+        labels=df.index,
+        vocab=words,
+        word_lengths=np.array([len(word) for word in words], dtype=np.int64),
+        ignored=np.array([word in words_to_ignore for word in words], dtype=bool),
+        ids=np.array(ids, dtype=np.int32),
+        offsets=offsets
+    )
+
+
+def get_message_lengths(token_index, df):
+    """Returns the number of tokens of every message in df"""
+
+    positions = token_index.labels.get_indexer(df.index)
+    return token_index.offsets[positions + 1] - token_index.offsets[positions]
+
+
+def get_token_ids(token_index, df, ignore=True):
+    """Returns the concatenated vocabulary ids of all messages in df, in order"""
+
+    positions = token_index.labels.get_indexer(df.index)
+    starts = token_index.offsets[positions]
+    lengths = token_index.offsets[positions + 1] - starts
+
+    # position of every wanted token within token_index.ids, without a python loop over messages
+    ends = np.cumsum(lengths)
+    shifts = np.repeat(starts - (ends - lengths), lengths)
+    ids = token_index.ids[np.arange(ends[-1] if len(ends) else 0) + shifts]
+
+    if ignore:
+        ids = ids[~token_index.ignored[ids]]
+    return ids
@@ -0,0 +1,138 @@
+import logging
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from modules.memo import memoize
+from modules.perf import timed
+from modules.tokens import get_token_ids
+from modules.messages import build_chat_index, _runs
+
+# Bounded summaries of the words (not ignored) of every (chat, participant, month): the CAPACITY most
+# used words of each, with their exact counts. blocks has a row per summary (title, sender_name, month,
+# tokens, bound), grouped like the messages so block_index (a ChatIndex) finds the months of a
+# participant. The counters of block b are ids[offsets[b]:offsets[b+1]] with counts, sorted by
+# descending count. A word that is not kept was used at most bound times in its block.
+TopWords = namedtuple(
+    'TopWords', ['blocks', 'block_index', 'offsets', 'ids', 'counts', 'vocab'])
+
+# counters kept per summary
+CAPACITY = 64
+
+
+def _month(timestamps):
+    return (timestamps.dt.year.values * 12 + timestamps.dt.month.values - 1).astype(np.int64)
+
+
+def _date_to_month(date):
+    date = pd.Timestamp(date)
+    return date.year * 12 + date.month - 1
+
+
+def _top(groups, ids, counts, n_groups, capacity):
+    """Keeps the capacity largest counters of every group, sorted by group and descending count (ties by id).
+    Returns them and, for every group, the largest count that was dropped"""
+
+    order = np.lexsort((ids, -counts, groups))
+    groups, ids, counts = groups[order], ids[order], counts[order]
+    ranks = np.arange(len(groups)) - np.searchsorted(groups, groups)
+
+    dropped = np.zeros(n_groups, dtype=np.int64)
+    dropped[groups[ranks == capacity]] = counts[ranks == capacity]
+
+    keep = ranks < capacity
+    return groups[keep], ids[keep], counts[keep], dropped
+
+
+def merge_summaries(summaries, capacity=CAPACITY):
+    """Merges summaries (ids, counts, errors, bound) of disjoint sets of messages: the months of a window,
+    or a block and the words of newly ingested messages. A true count lies between the count and
+    count + error of a kept word, a word that is not kept was used at most bound times.
+    Returns the merged summary, its counters sorted by descending count (ties by vocabulary id)"""
+
+    ids = np.concatenate([summary[0] for summary in summaries])
+    counts = np.concatenate([summary[1] for summary in summaries])
+    errors = np.concatenate([summary[2] for summary in summaries])
+    bounds = np.array([summary[3] for summary in summaries], dtype=np.int64)
+    # the bound of the summary every counter comes from
+    held = np.repeat(bounds, [len(summary[0]) for summary in summaries])
+
+    words, inverse = np.unique(ids, return_inverse=True)
+    totals = np.bincount(inverse, weights=counts,
+                         minlength=len(words)).astype(np.int64)
+    # a word missing from a summary may have been used up to its bound there
+    missing = bounds.sum() - np.bincount(inverse, weights=held, minlength=len(words)).astype(np.int64)
+    errors = np.bincount(inverse, weights=errors, minlength=len(words)).astype(np.int64) + missing
+
+    order = np.lexsort((words, -totals))
+    kept, dropped = order[:capacity], order[capacity:]
+    bound = max(bounds.sum(), (totals[dropped] + errors[dropped]).max(initial=0))
+    return words[kept], totals[kept], errors[kept], bound
+
+
+@timed
+def build_top_words(df, token_index, capacity=CAPACITY):
+    """Summaries of every (chat, participant, month) of df, which must be grouped like load_data returns it"""
+
+    title_codes, _ = pd.factorize(df['title'])
+    sender_codes, _ = pd.factorize(df['sender_name'])
+    months = _month(df['timestamp'])
+    starts, stops = _runs(title_codes, sender_codes, months)
+    message_blocks = np.repeat(np.arange(len(starts)), stops - starts)
+
+    # the exact counts of every block, of which the capacity largest are kept
+    positions = token_index.labels.get_indexer(df.index)
+    lengths = token_index.offsets[positions + 1] - token_index.offsets[positions]
+    ids = get_token_ids(token_index, df, ignore=False).astype(np.int64)
+    token_blocks = np.repeat(message_blocks, lengths)
+    wanted = ~token_index.ignored[ids]
+    ids, token_blocks = ids[wanted], token_blocks[wanted]
+
+    vocab_size = len(token_index.vocab)
+    keys, counts = np.unique(token_blocks * vocab_size + ids, return_counts=True)
+    groups, ids, counts, bound = _top(
+        keys // vocab_size, keys % vocab_size, counts.astype(np.int64), len(starts), capacity)
+
+    blocks = pd.DataFrame({
+        'title': df['title'].values[starts],
+        'sender_name': df['sender_name'].values[starts],
+        'month': months[starts],
+        'tokens': np.bincount(token_blocks, minlength=len(starts)),
+        'bound': bound,
+    })
+    logging.info(
+        f'Summarized the words of {len(blocks)} (chat, participant, month) blocks in {len(ids)} counters.')
+
+    return TopWords(
+        blocks=blocks,
+        block_index=build_chat_index(blocks),
+        offsets=np.searchsorted(groups, np.arange(len(starts) + 1)),
+        ids=ids.astype(np.int32),
+        counts=counts,
+        vocab=token_index.vocab,
+    )
+
+
+@timed
+@memoize
+def get_top_words(top_words, chat_title, sender_name, k=10, start_date=None, end_date=None):
+    """The k most used words, as (word, count, error), of a participant of a chat, in the months from
+    start_date to end_date (both optional). Counts are exact when their error is 0, else the true
+    count is at most count + error"""
+
+    first, last = top_words.block_index.senders.get(
+        (chat_title, sender_name), (0, 0))
+    months = top_words.blocks['month'].values[first:last]
+    lo = np.searchsorted(months, _date_to_month(start_date)) if start_date else 0
+    hi = np.searchsorted(months, _date_to_month(end_date), side='right') if end_date else len(months)
+
+    offsets, bounds = top_words.offsets, top_words.blocks['bound'].values
+    summaries = [(top_words.ids[offsets[b]:offsets[b + 1]], top_words.counts[offsets[b]:offsets[b + 1]],
+                  np.zeros(offsets[b + 1] - offsets[b], dtype=np.int64), bounds[b])
+                 for b in range(first + lo, first + max(lo, hi))]
+    if not summaries:
+        return []
+
+    ids, counts, errors, _ = merge_summaries(summaries, k)
+    return [(top_words.vocab[i], int(count), int(error)) for i, count, error in zip(ids, counts, errors)]
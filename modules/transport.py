@@ -0,0 +1,108 @@
+import base64
+
+import numpy as np
+import pandas as pd
+from dash.dependencies import ClientsideFunction, Input, Output
+
+from config import BINARY_FIGURES
+
+# shorter arrays stay JSON lists, encoding them saves nothing
+MIN_LENGTH = 8
+
+# typed arrays for integers counted from their minimum, the narrowest that fits is used.
+# See assets/transport.js for the decoding
+INTEGER_DTYPES = [('u1', 2**8 - 1), ('u2', 2**16 - 1), ('u4', 2**32 - 1)]
+
+NUMERIC_TYPES = {'integer', 'floating', 'mixed-integer-float', 'decimal'}
+DATE_TYPES = {'datetime64', 'datetime', 'date'}
+
+
+def _encode_array(values):
+    """{'dtype', 'bdata'} holding the numbers of values as a base64 little-endian buffer. Integers,
+    like dates in milliseconds, are stored as offset + scale * value in the narrowest type"""
+
+    values = np.asarray(values, dtype=np.float64)
+    encoded = {'dtype': 'f8'}
+    if len(values) and np.isfinite(values).all() and np.all(values == np.round(values)):
+        offset = values.min()
+        steps = (values - offset).astype(np.int64)
+        scale = max(int(np.gcd.reduce(steps)), 1)
+        steps //= scale
+        dtype = next((name for name, high in INTEGER_DTYPES if steps.max() <= high), None)
+        if dtype is not None:
+            values = steps
+            encoded['dtype'] = dtype
+            if offset or scale != 1:
+                encoded.update(offset=offset, scale=scale)
+    buffer = values.astype(np.dtype(encoded['dtype']).newbyteorder('<')).tobytes()
+    encoded['bdata'] = base64.b64encode(buffer).decode('ascii')
+    return encoded
+
+
+def _kind(values):
+    if isinstance(values, np.ndarray):
+        if values.ndim != 1:
+            return None
+        if values.dtype.kind in 'iuf':
+            return 'numeric'
+        if values.dtype.kind == 'M':
+            return 'date'
+    elif not isinstance(values, (list, tuple)):
+        return None
+    if len(values) < MIN_LENGTH:
+        return None
+
+    inferred = pd.api.types.infer_dtype(values, skipna=True)
+    if inferred in NUMERIC_TYPES:
+        return 'numeric'
+    if inferred in DATE_TYPES:
+        return 'date'
+    return None
+
+
+def _encode(value):
+    if isinstance(value, dict):
+        return {key: _encode(item) for key, item in value.items()}
+    if _kind(value) == 'numeric':
+        return _encode_array(value)
+    if isinstance(value, (list, tuple)):
+        return [_encode(item) for item in value]
+    return value
+
+
+def encode_figure(figure, binary=None):
+    """The figure as a dict in which numeric arrays are typed binary buffers, dates become
+    milliseconds since the epoch on date axes. Store it in the dcc.Store of register_figure_decoder.
+    binary defaults to BINARY_FIGURES, with False the figure is left as plain JSON"""
+
+    figure = figure.to_dict() if hasattr(figure, 'to_dict') else dict(figure)
+    if binary is None:
+        binary = BINARY_FIGURES
+    if not binary:
+        return figure
+
+    layout = dict(figure.get('layout', {}))
+    data = []
+    for trace in figure.get('data', []):
+        trace = dict(trace)
+        for axis in ('x', 'y'):
+            if _kind(trace.get(axis)) == 'date':
+                dates = pd.DatetimeIndex(trace[axis])
+                milliseconds = dates.asi8 // 10**6
+                trace[axis] = np.where(dates.isna(), np.nan, milliseconds)
+                # x2 is drawn on xaxis2
+                name = trace.get(f'{axis}axis', axis).replace(axis, f'{axis}axis', 1)
+                layout[name] = dict(layout.get(name, {}), type='date')
+        data.append(_encode(trace))
+
+    return dict(figure, data=data, layout=layout)
+
+
+def register_figure_decoder(app, graph_id):
+    """Draws the figures stored by a callback in graph_id-data on graph_id, decoded in the browser"""
+
+    app.clientside_callback(
+        ClientsideFunction(namespace='transport', function_name='decode_figure'),
+        Output(graph_id, 'figure'),
+        [Input(f'{graph_id}-data', 'data')]
+    )
@@ -0,0 +1,8 @@
+from index import app
+from modules.store import wait_for_all
+
+# load everything, the network graph included, before gunicorn forks the workers so they share it
+wait_for_all()
+
+# WSGI entry point, run with: gunicorn -c gunicorn.conf.py wsgi:server
+server = app.server